@@ -7,7 +7,14 @@ from weapons import EE12HP, Rotation
 class Artifact:
     """
     Represents artifact sets.
+
+    Attributes:
+        main_stats: Stats fields of the flower, plume, sands, goblet and circlet
+            main stats, in that order. A piece never rolls its main stat as a
+            substat.
     """
+
+    main_stats = ('flat_hp', 'flat_atk', 'atk', 'anemo_dmg', 'cdmg')
     
     def __init__(self, rotation: Rotation = EE12HP()):
         self.base_stats = Stats(flat_hp=4780, flat_atk=311, atk=0.466, anemo_dmg=0.466, cdmg=0.622)
@@ -34,6 +41,8 @@ class Vermillion(Artifact):
         return Stats(atk=0.08 + 0.1*num_stacks)
 
 class VermillionAtkGoblet(Vermillion):
+    main_stats = ('flat_hp', 'flat_atk', 'atk', 'atk', 'cdmg')
+
     def __init__(self, rotation: Rotation = EE12HP()):
         self.base_stats = Stats(flat_hp=4780, flat_atk=311, atk=0.466*2, cdmg=0.622)
         self.rotation = rotation
@@ -86,6 +95,8 @@ class DesertPavilionAtkGoblet(DesertPavilion):
     4pc Desert Pavilion's Chronicle with ATK Goblet.
     """
 
+    main_stats = ('flat_hp', 'flat_atk', 'atk', 'atk', 'cdmg')
+
     def __init__(self, rotation: Rotation = EE12HP()):
         super().__init__(rotation)
         self.base_stats = Stats(flat_hp=4780, flat_atk=311, atk=0.932, cdmg=0.622)
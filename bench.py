@@ -0,0 +1,209 @@
+from main import *
+import furina
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+from functools import partial
+from tabulate import tabulate
+
+# Configurations benchmarked. Kept to buffs and weapons every rotation supports.
+ROTATIONS = [EE12HP, EE8N1CJP]
+ARTIFACT_SETS = [AtkAtk, Vermillion, Hunter]
+BUFF_COMBOS = [
+    [Solo],
+    [Bennett, Noblesse, FaruzanC6],
+    [FaruzanC6, TTDS, Zhongli, Noblesse, TotM]
+]
+WEAPONS = [
+    partial(PJWS),
+    partial(Homa, below50=True),
+    partial(CalamityQueller, stacked=False),
+    partial(EngulfingLightning)
+]
+CHART_WEAPONS = WEAPONS + [
+    partial(Vortex, shielded=True, stacked=True),
+    partial(StaffOfTheScarletSands),
+    partial(Lithic, stacks=3),
+    partial(Deathmatch, num_opponents=1),
+    partial(Blackcliff, stacks=2),
+    partial(FavoniusLance)
+]
+METHODS = ['brute', 'vectorized', 'search', 'warm', 'continuous']
+
+def measure(func, repeat: int):
+    """
+    Times func over repeat runs after one warmup run, then runs it once more
+    under tracemalloc for its peak memory.
+    """
+    func()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    median = statistics.median(timings)
+    return {
+        'ops_per_sec': 1.0 / median if median > 0 else float('inf'),
+        'median_s': median,
+        'mean_s': statistics.mean(timings),
+        'min_s': min(timings),
+        'stdev_s': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'repeat': repeat,
+        'peak_memory_bytes': peak
+    }
+
+def cases():
+    """
+    Yields (name, params, func) for every benchmark.
+    """
+    for rotation_type in ROTATIONS:
+        rotation = rotation_type()
+        for artifact_set in ARTIFACT_SETS:
+            for buff_types in BUFF_COMBOS:
+                buffs = [buff_type(rotation=rotation) for buff_type in buff_types]
+                for weapon in WEAPONS:
+                    params = {
+                        'rotation': str(rotation),
+                        'artifact': artifact_set.__name__,
+                        'weapon': str(weapon(refine=1)),
+                        'num_buffs': len(buffs) if buff_types != [Solo] else 0
+                    }
+                    yield 'rotation_dmg', params, partial(
+                        _rotation_dmg, weapon(1, rotation=rotation), artifact_set, buffs, rotation
+                    )
+
+    rotation = EE12HP()
+    for num_subs in [20, 25]:
+        for method in METHODS:
+            for buff_types in BUFF_COMBOS:
+                buffs = [buff_type(rotation=rotation) for buff_type in buff_types]
+                for weapon in WEAPONS:
+                    params = {
+                        'num_subs': num_subs,
+                        'method': method,
+                        'weapon': str(weapon(refine=1)),
+                        'num_buffs': len(buffs) if buff_types != [Solo] else 0
+                    }
+                    yield 'optimize', params, partial(
+                        optimize, num_subs, AtkAtk, weapon(1, rotation=rotation), buffs, rotation, method=method
+                    )
+
+    buff_combo = [FaruzanC6, CraneXianyun, Zhongli, Noblesse, TotM]
+    for method in METHODS:
+        params = {'method': method, 'buffs': '-'.join(buff.__name__ for buff in buff_combo), 'num_weapons': len(CHART_WEAPONS)}
+        yield 'main', params, partial(_chart, buff_combo, method)
+
+    for config_name in furina.configs():
+        yield 'furina', {'config': config_name}, partial(_furina_run, config_name)
+
+    for config_name in furina.configs():
+        params = {'config': config_name, 'variants': 10000}
+        yield 'furina_sweep', params, partial(_furina_sweep, config_name, 10000)
+
+def _rotation_dmg(weapon, artifact_set, buffs, rotation):
+    artifact = artifact_set(rotation=rotation)
+    artifact.base_stats.add_artifact_subs(atk=8, crate=8, cdmg=9)
+    return rotation_dmg(weapon, artifact, buffs, rotation)
+
+def _chart(buff_combo, method):
+    # main() writes CSVs relative to the working directory and prints its chart.
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+        os.chdir(directory)
+        try:
+            main(25, AtkAtk, [buff_combo], CHART_WEAPONS, EE12HP(), method=method)
+        finally:
+            os.chdir(cwd)
+
+def _furina_run(config_name):
+    # Rotations are stateful, so each run needs a fresh one.
+    rotation = furina.configs()[config_name]
+    with contextlib.redirect_stdout(io.StringIO()):
+        rotation.run()
+
+def _furina_sweep(config_name, num_variants):
+    rotation = furina.configs()[config_name]
+    rotation.run_variants(num_variants, hp_range=(0.5, 1.0), jitter=0.1, seed=0)
+
+def run(repeat: int, name_filter: str = None):
+    """
+    Runs every benchmark whose name or params contain name_filter.
+    """
+    results = []
+    for name, params, func in cases():
+        label = '{} {}'.format(name, json.dumps(params, sort_keys=True))
+        if name_filter and name_filter not in label:
+            continue
+        result = {'name': name, 'params': params}
+        result.update(measure(func, repeat))
+        results.append(result)
+    return results
+
+def print_results(results, baseline=None):
+    """
+    Prints a summary table. With a baseline report, also prints the speedup of each benchmark.
+    """
+    baseline_ops = {}
+    if baseline:
+        for result in baseline['results']:
+            baseline_ops[_result_key(result)] = result['ops_per_sec']
+
+    table = [['Benchmark', 'Params', 'ops/sec', 'median (ms)', 'peak mem (KiB)']]
+    if baseline:
+        table[0].append('speedup')
+    for result in results:
+        row = [
+            result['name'],
+            ', '.join('{}={}'.format(k, v) for k, v in result['params'].items()),
+            result['ops_per_sec'],
+            result['median_s'] * 1000,
+            result['peak_memory_bytes'] / 1024
+        ]
+        if baseline:
+            before = baseline_ops.get(_result_key(result))
+            row.append(result['ops_per_sec'] / before if before else None)
+        table.append(row)
+    print(tabulate(table, headers='firstrow', floatfmt='.2f'))
+
+def _result_key(result):
+    return result['name'], json.dumps(result['params'], sort_keys=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the damage engine and the Furina simulator.')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per benchmark')
+    parser.add_argument('--filter', help='only run benchmarks whose name or params contain this string')
+    parser.add_argument('--json', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.filter)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='UTF8') as infile:
+            baseline = json.load(infile)
+    print_results(results, baseline)
+
+    if args.json:
+        report = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results
+        }
+        with open(args.json, 'w', encoding='UTF8') as outfile:
+            json.dump(report, outfile, indent=2)
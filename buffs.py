@@ -1,6 +1,8 @@
 from rotations import *
 from stats import Stats
 
+import furina
+
 class Buff:
     """
     Generic representation for a team buff for Xiao.
@@ -145,10 +147,47 @@ class FurinaC050HP(Buff):
     def buff(self, num_hits=0):
         return Stats(bonus_dmg=0.25 * (self.rotation.fanfare_50(num_hits) * 0.01))
 
-class FurinaWithXianyun(Buff):
+class FurinaTeam(Buff):
+    """
+    C0 Furina. 0.25% DMG Bonus per Fanfare, with her Fanfare at each hit
+    simulated by furina.py for a team config.
+
+    Attributes:
+        team: Name of the team config in furina.configs().
+    """
+
+    team = None
+
     def buff(self, num_hits=0):
-        furina_fanfare = [72, 81, 136, 155, 221, 240, 282, 290, 300, 300, 300, 300, 0, 0]
-        return Stats(bonus_dmg=0.0025*furina_fanfare[num_hits])    
+        return Stats(bonus_dmg=0.0025*furina.tables(self.team).fanfare[num_hits])
+
+class FurinaWithXianyun(FurinaTeam):
+    """
+    C0 Furina with C0 Xianyun on R5 TTDS.
+    """
+
+    team = 'XianyunTTDS'
+
+class FurinaWithXianyunCrane(FurinaTeam):
+    """
+    C0 Furina with C0 Xianyun on R1 Crane.
+    """
+
+    team = 'XianyunCrane'
+
+class FurinaWithJean(FurinaTeam):
+    """
+    C0 Furina with C0 Jean.
+    """
+
+    team = 'JeanC0_100'
+
+class FurinaWithBennett(FurinaTeam):
+    """
+    C0 Furina with Bennett.
+    """
+
+    team = 'Bennett_100'
 
 class TTDSXianyun(Buff):
     def buff(self, num_hits=0):
@@ -0,0 +1,180 @@
+import argparse
+from functools import lru_cache
+import hashlib
+import inspect
+import json
+import numpy as np
+import os
+
+class CellCache:
+    """
+    On-disk cache of chart cell results, keyed by a hash of the cell's full
+    configuration (see cell_key).
+
+    Attributes:
+        directory: Directory the cache entries are stored in.
+        max_entries: Maximum number of entries to keep. Least recently used entries
+            are evicted first.
+    """
+
+    def __init__(self, directory: str = '.cache/cells', max_entries: int = 200000):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._num_entries = None
+
+    ##################
+    # Public Methods #
+    ##################
+
+    def get(self, key: str):
+        """
+        Returns the cached value for key, or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            with open(path, encoding='UTF8') as infile:
+                value = json.load(infile)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        # Entry modification time doubles as the LRU timestamp.
+        os.utime(path)
+        return value
+
+    def put(self, key: str, value):
+        """
+        Stores a JSON serializable value for key, evicting old entries if the cache is full.
+        """
+        path = self._path(key)
+        is_new = not os.path.exists(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write then rename, so readers never see a partial entry.
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w', encoding='UTF8') as outfile:
+            json.dump(value, outfile)
+        os.replace(tmp_path, path)
+
+        if is_new:
+            if self._num_entries is None:
+                self._num_entries = len(self._entries())
+            else:
+                self._num_entries += 1
+            if self._num_entries > self.max_entries:
+                self._evict()
+
+    def clear(self):
+        """
+        Invalidates the cache by removing every entry. Returns the number removed.
+        """
+        entries = self._entries()
+        for path in entries:
+            os.remove(path)
+        self._num_entries = 0
+        return len(entries)
+
+    def info(self):
+        """
+        Returns the number of entries and their total size in bytes.
+        """
+        entries = self._entries()
+        return len(entries), sum(os.path.getsize(path) for path in entries)
+
+    ###################
+    # Private Methods #
+    ###################
+
+    def _path(self, key: str):
+        return os.path.join(self.directory, key[:2], '{}.json'.format(key))
+
+    def _entries(self):
+        """
+        Returns the paths of all entries.
+        """
+        entries = []
+        for root, _, filenames in os.walk(self.directory):
+            entries.extend(os.path.join(root, name) for name in filenames if name.endswith('.json'))
+        return entries
+
+    def _evict(self):
+        """
+        Removes least recently used entries until the cache is at 90% of max_entries,
+        so a full cache is not rescanned on every put.
+        """
+        entries = sorted(self._entries(), key=os.path.getmtime)
+        num_evicted = max(0, len(entries) - int(self.max_entries * 0.9))
+        for path in entries[:num_evicted]:
+            os.remove(path)
+        self._num_entries = len(entries) - num_evicted
+
+
+def cell_key(config: dict, sources=()):
+    """
+    Returns a content hash of a chart cell's configuration.
+
+    Args:
+        config: Everything the cell's result depends on, e.g. weapon, artifact set,
+            buffs, rotation and number of subs. Objects are described by their class
+            and attributes, and every class involved is fingerprinted by its source.
+        sources: Extra functions or classes to fingerprint, e.g. the optimizer.
+    """
+    classes = set()
+    description = _describe(config, classes)
+    fingerprints = sorted(_source_fingerprint(obj) for obj in list(classes) + list(sources))
+    payload = json.dumps([description, fingerprints], sort_keys=True)
+    return hashlib.sha256(payload.encode('UTF8')).hexdigest()
+
+def _describe(value, classes: set):
+    """
+    Returns a JSON serializable description of value, collecting every class seen.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [_describe(item, classes) for item in value]
+    if isinstance(value, dict):
+        return {str(k): _describe(v, classes) for k, v in value.items()}
+    if isinstance(value, type):
+        classes.update(cls for cls in value.__mro__ if cls is not object)
+        return value.__qualname__
+
+    # functools.partial, e.g. the weapons list in main.py.
+    if hasattr(value, 'func') and hasattr(value, 'keywords'):
+        return {
+            'func': _describe(value.func, classes),
+            'args': _describe(value.args, classes),
+            'keywords': _describe(value.keywords, classes)
+        }
+
+    cls = type(value)
+    if hasattr(value, '__dict__'):
+        attrs = vars(value)
+    else:
+        attrs = {name: getattr(value, name) for name in getattr(cls, '__slots__', ())}
+    return {'class': _describe(cls, classes), 'attrs': _describe(attrs, classes)}
+
+@lru_cache(maxsize=None)
+def _source_fingerprint(obj):
+    """
+    Returns a hash of the source code of a class or function.
+    """
+    try:
+        source = inspect.getsource(obj)
+    except (OSError, TypeError):
+        source = obj.__qualname__
+    return hashlib.sha256(source.encode('UTF8')).hexdigest()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage the chart cell result cache.')
+    parser.add_argument('command', choices=['info', 'clear'], help='info: show cache size, clear: invalidate every entry')
+    parser.add_argument('--dir', default='.cache/cells', help='cache directory')
+    args = parser.parse_args()
+
+    cache = CellCache(args.dir)
+    if args.command == 'clear':
+        print('Removed {} entries from {}'.format(cache.clear(), args.dir))
+    else:
+        num_entries, num_bytes = cache.info()
+        print('{}: {} entries, {} bytes'.format(args.dir, num_entries, num_bytes))
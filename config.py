@@ -0,0 +1,150 @@
+import artifacts
+import buffs
+import rotations
+import weapons
+
+import argparse
+from functools import partial
+import json
+
+def load(filename: str):
+    """
+    Loads a JSON or TOML chart config, e.g. config.toml.
+    """
+    with open(filename, 'rb') as infile:
+        if not filename.endswith('.toml'):
+            return json.load(infile)
+        try:
+            import tomllib
+        except ImportError:
+            raise ValueError('TOML configs need Python 3.11+, use a JSON config instead: {}'.format(filename))
+        return tomllib.load(infile)
+
+def weapon(spec: dict):
+    """
+    Returns a weapon partial for a config entry, e.g. {"name": "Homa", "below50": true}.
+    """
+    kwargs = dict(spec)
+    weapon_type = _lookup(weapons, kwargs.pop('name'), weapons.Weapon, 'weapon')
+    return partial(weapon_type, **kwargs)
+
+def buff(name: str):
+    """
+    Returns the Buff class with the given name.
+    """
+    return _lookup(buffs, name, buffs.Buff, 'buff')
+
+def artifact_set(name: str):
+    """
+    Returns the Artifact class with the given name.
+    """
+    return _lookup(artifacts, name, artifacts.Artifact, 'artifact set')
+
+def rotation(name: str):
+    """
+    Returns a new instance of the Rotation with the given name.
+    """
+    return _lookup(rotations, name, rotations.Rotation, 'rotation')()
+
+def argument_parser():
+    """
+    Returns the command line parser for main.py.
+    """
+    parser = argparse.ArgumentParser(
+        description='Generate Xiao weapon charts. Filters narrow the config down to the cells you need; '
+        'each filter can be given more than once.'
+    )
+    parser.add_argument('--config', default='config.toml', help='JSON or TOML config file (default: config.toml)')
+    parser.add_argument('--weapon', action='append', help='weapon class or chart name, e.g. Homa or "Homa (50%%)"')
+    parser.add_argument('--refine', action='append', type=int, help='weapon refinement, 1-5')
+    parser.add_argument('--artifact', action='append', help='artifact set, e.g. AtkAtk')
+    parser.add_argument(
+        '--buffs', action='append',
+        help='buff combo, e.g. FaruzanC6-CraneXianyun-Zhongli. Combos not in the config are computed as given'
+    )
+    parser.add_argument('--rotation', action='append', help='rotation, e.g. EE12HP')
+    parser.add_argument('--num-subs', action='append', type=int, help='number of artifact substats')
+    parser.add_argument('--extra-er-subs', action=argparse.BooleanOptionalAction, help='give ER weapons 5 extra subs')
+    parser.add_argument('--method', choices=['brute', 'vectorized', 'search', 'warm', 'continuous'], help='substat optimizer')
+    parser.add_argument('--workers', type=int, help='number of processes')
+    parser.add_argument('--no-cache', action='store_true', help='recompute every cell instead of using the cache')
+    parser.add_argument(
+        '--write', action=argparse.BooleanOptionalAction,
+        help='save charts to the results database, or CSVs with --csv. Default: on unless --weapon or --refine '
+        'narrow the charts'
+    )
+    parser.add_argument('--csv', action='store_true', help='write CSVs to charts/, substats/ and marginals/ instead of the results database')
+    parser.add_argument(
+        '--trace', action='store_true',
+        help='write the per-hit damage breakdown of every cell at its optimum to traces/'
+    )
+    parser.add_argument('--profile', help='profile hot paths and write a JSON report to this file')
+    return parser
+
+def select(settings: dict, args):
+    """
+    Resolves a loaded config into the arguments of main.main, keeping only what
+    matches the command line filters in args.
+
+    Returns:
+        dict of num_subs, rotations, artifact_sets, buff_combos, weapons, refines,
+        extra_er_subs, method, workers, chunksize, cache_dir, results, write and
+        positions.
+    """
+    selected = {
+        'num_subs': args.num_subs or settings['num_subs'],
+        'rotations': [rotation(name) for name in args.rotation or settings['rotations']],
+        'artifact_sets': [artifact_set(name) for name in args.artifact or settings['artifact_sets']],
+        'refines': sorted(set(args.refine or settings.get('refines', [1, 2, 3, 4, 5]))),
+        'extra_er_subs': settings.get('extra_er_subs', False) if args.extra_er_subs is None else args.extra_er_subs,
+        'method': args.method or settings.get('method', 'vectorized'),
+        'workers': args.workers or settings.get('workers', 1),
+        'chunksize': settings.get('chunksize', 1),
+        'cache_dir': None if args.no_cache else settings.get('cache') or None,
+        'results': None if args.csv else settings.get('results') or None,
+    }
+    if any(refine not in range(1, 6) for refine in selected['refines']):
+        raise ValueError('Refinements must be between 1 and 5: {}'.format(selected['refines']))
+
+    buff_combos = [[buff(name) for name in combo] for combo in settings['buff_combos']]
+    if args.buffs:
+        buff_combos = [_select_combo(buff_combos, combo) for combo in args.buffs]
+    selected['buff_combos'] = buff_combos
+
+    weapon_list = [weapon(spec) for spec in settings['weapons']]
+    positions = list(range(len(weapon_list)))
+    if args.weapon:
+        names = {name.lower() for name in args.weapon}
+        positions = [
+            position for position, weapon_type in enumerate(weapon_list)
+            if weapon_type.func.__name__.lower() in names or str(weapon_type(refine=1)).lower() in names
+        ]
+        if not positions:
+            raise ValueError('No configured weapon matches {}'.format(args.weapon))
+    selected['weapons'] = [weapon_list[position] for position in positions]
+    # Each weapon's place in the full configured chart, see main.solve_charts.
+    selected['positions'] = positions
+
+    # Only overwrite chart CSVs with complete charts, unless asked to.
+    selected['write'] = args.write if args.write is not None else not (args.weapon or args.refine)
+    return selected
+
+def _select_combo(buff_combos, combo: str):
+    """
+    Returns the configured buff combo with the same buffs as combo, or combo's
+    buffs in the given order if none is configured.
+    """
+    buff_types = [buff(name) for name in combo.replace(',', '-').split('-') if name]
+    for configured in buff_combos:
+        if set(configured) == set(buff_types):
+            return configured
+    return buff_types
+
+def _lookup(module, name: str, base: type, kind: str):
+    """
+    Returns the subclass of base called name defined in module.
+    """
+    value = getattr(module, name, None)
+    if not isinstance(value, type) or not issubclass(value, base):
+        raise ValueError('Unknown {}: {}'.format(kind, name))
+    return value
@@ -0,0 +1,96 @@
+import numpy as np
+
+class Dual:
+    """
+    Dual number for forward mode differentiation. Carries a value and its partial
+    derivatives with respect to any number of inputs through arithmetic, so a
+    Stats holding Duals differentiates everything computed from it, e.g. Xiao's
+    rotation damage.
+
+    Comparisons only look at the value, so branches like the crit rate cap in
+    Xiao._dmgcalc take the branch of the value and its derivatives.
+
+    Attributes:
+        value: The value.
+        grad: NumPy array of the value's partial derivatives.
+    """
+
+    __slots__ = ('value', 'grad')
+
+    def __init__(self, value, grad):
+        self.value = value
+        self.grad = grad
+
+    @classmethod
+    def variable(cls, value, index: int, num_variables: int):
+        """
+        Returns the index-th of num_variables input variables, with the given value.
+        """
+        grad = np.zeros(num_variables)
+        grad[index] = 1.0
+        return cls(value, grad)
+
+    #################
+    # Magic Methods #
+    #################
+
+    def __add__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.value + other.value, self.grad + other.grad)
+        return Dual(self.value + other, self.grad)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.value - other.value, self.grad - other.grad)
+        return Dual(self.value - other, self.grad)
+
+    def __rsub__(self, other):
+        return Dual(other - self.value, -self.grad)
+
+    def __neg__(self):
+        return Dual(-self.value, -self.grad)
+
+    def __mul__(self, other):
+        if isinstance(other, Dual):
+            return Dual(self.value * other.value, self.value * other.grad + other.value * self.grad)
+        return Dual(self.value * other, self.grad * other)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        if isinstance(other, Dual):
+            return Dual(
+                self.value / other.value,
+                (self.grad * other.value - self.value * other.grad) / (other.value * other.value)
+            )
+        return Dual(self.value / other, self.grad / other)
+
+    def __rtruediv__(self, other):
+        return Dual(other / self.value, -other * self.grad / (self.value * self.value))
+
+    def __lt__(self, other):
+        return self.value < _value(other)
+
+    def __le__(self, other):
+        return self.value <= _value(other)
+
+    def __gt__(self, other):
+        return self.value > _value(other)
+
+    def __ge__(self, other):
+        return self.value >= _value(other)
+
+    def __float__(self):
+        return float(self.value)
+
+    def __repr__(self):
+        return 'Dual({!r}, {!r})'.format(self.value, self.grad)
+
+
+def _value(x):
+    """
+    Returns the value of a Dual or plain number.
+    """
+    return x.value if isinstance(x, Dual) else x
@@ -1,7 +1,13 @@
-from bisect import insort
+import argparse
+from collections import namedtuple
+from functools import lru_cache
+import heapq
+import itertools
 import math
+import numpy as np
 import os
 import csv
+from tabulate import tabulate
 
 class Character:
     """
@@ -10,7 +16,10 @@ class Character:
     Attributes:
         name: character name
         max_hp: character's max hp
-        current_hp: character's current hp, as a % of their max hp
+        current_hp: character's current hp, as a % of their max hp. May be a NumPy
+            array with one entry per variant, see XiaoFaruzanFurinaRotation.run_variants.
+
+    Each HP change takes a where mask of the variants it applies to.
     """
 
     def __init__(self, name: str, max_hp: int, current_hp: float):
@@ -18,35 +27,35 @@ class Character:
         self.max_hp = max_hp
         self.current_hp = max_hp * current_hp
     
-    def heal(self, heal_hp: int):
+    def heal(self, heal_hp: int, where=True):
         """
         Heal a fixed HP amount.
         """
-        healed = min(heal_hp, self.max_hp - self.current_hp)
-        self.current_hp += healed
+        healed = _where(where, _minimum(heal_hp, self.max_hp - self.current_hp), 0.0)
+        self.current_hp = self.current_hp + healed
         return healed / self.max_hp * 100
 
-    def heal_max(self, heal_percent: float):
+    def heal_max(self, heal_percent: float, where=True):
         """
         Heal a % of max HP.
         """
-        healed = min(self.max_hp * heal_percent, self.max_hp - self.current_hp)
-        self.current_hp += healed
+        healed = _where(where, _minimum(self.max_hp * heal_percent, self.max_hp - self.current_hp), 0.0)
+        self.current_hp = self.current_hp + healed
         return healed / self.max_hp * 100
 
-    def drain_max(self, drain_percent: float):
+    def drain_max(self, drain_percent: float, where=True):
         """
         Drain a % of max HP.
         """
-        self.current_hp -= self.max_hp * drain_percent
-        return drain_percent * 100
+        self.current_hp = self.current_hp - _where(where, self.max_hp * drain_percent, 0.0)
+        return _where(where, drain_percent * 100, 0.0)
 
-    def drain_curr(self, drain_percent: float):
+    def drain_curr(self, drain_percent: float, where=True):
         """
         Drain a % of current HP.
         """
-        hp_drain = self.current_hp * drain_percent
-        self.current_hp -= hp_drain
+        hp_drain = _where(where, self.current_hp * drain_percent, 0.0)
+        self.current_hp = self.current_hp - hp_drain
         return hp_drain / self.max_hp * 100
     
     def above50(self):
@@ -72,11 +81,20 @@ class XiaoFaruzanFurinaRotation:
 
     Attributes:
         current_hp: % of max HP each character should start at
+        timeline: Heap of pending (time, sequence, action) events, see add.
+        xiao_hits: (Fanfare, Xiao's HP as a % of max HP) at each of Xiao's hits
+            in the last run.
+        time: Time of the action being run, or None before the rotation runs.
+        active: Mask of the variants performing the current action while running
+            variants, see run_variants. Actions only change state where active.
     """
 
     def __init__(self, current_hp: float = 1.0):
         # Rotation timeline
         self.timeline = []
+        self.time = None
+        self.active = True
+        self._sequence = itertools.count()
 
         # Characters
         self.characters = []
@@ -84,6 +102,8 @@ class XiaoFaruzanFurinaRotation:
         self.faruzan = Character("Faruzan", 17722.0, current_hp)
         self.furina = Character("Furina", 34561.0, current_hp)
 
+        self.xiao_hits = []
+
         # Action instances
         self.fanfare = 0.0
         self.plunge = 0
@@ -94,56 +114,56 @@ class XiaoFaruzanFurinaRotation:
         self.furina_burst = False
 
     def FurinaBurst(self, time):
-        self.furina_burst = True
-        self.fanfare = 0.0
+        self.furina_burst = _where(self.active, True, self.furina_burst)
+        self.fanfare = _where(self.active, 0.0, self.fanfare)
         return "Furina Burst", self.fanfare
 
     def FurinaBurstEnd(self, time):
-        self.furina_burst = False
-        self.fanfare = 0.0
+        self.furina_burst = _where(self.active, False, self.furina_burst)
+        self.fanfare = _where(self.active, 0.0, self.fanfare)
         return "Furina Burst End", self.fanfare
 
     def FurinaSeaHorse(self, time):
         """
         Furina's Seahorse hits.
         """
-        self.furina_seahorse += 1
+        self.furina_seahorse += self.active
         drain = 0
         for character in self.characters:
-            if (character.above50()):
-                self.fanfare += character.drain_max(0.016)
-                drain += 1
+            where = self.active & character.above50()
+            self.fanfare += character.drain_max(0.016, where)
+            drain += where
         return "Furina Seahorse {} ({} drained)".format(self.furina_seahorse, drain), self.fanfare
     
     def FurinaOctopus(self, time):
         """
         Furina's Octopus hits.
         """
-        self.furina_octopus += 1
+        self.furina_octopus += self.active
         drain = 0
         for character in self.characters:
-            if (character.above50()):
-                self.fanfare += character.drain_max(0.024)
-                drain += 1
+            where = self.active & character.above50()
+            self.fanfare += character.drain_max(0.024, where)
+            drain += where
         return "Furina Octopus {} ({} drained)".format(self.furina_octopus, drain), self.fanfare
     
     def FurinaCrab(self, time):
         """
         Furina's Crab hits.
         """
-        self.furina_crab += 1
+        self.furina_crab += self.active
         drain = 0
         for character in self.characters:
-            if (character.above50()):
-                self.fanfare += character.drain_max(0.036)
-                drain += 1
+            where = self.active & character.above50()
+            self.fanfare += character.drain_max(0.036, where)
+            drain += where
         return "Furina Crab {} ({} drained)".format(self.furina_crab, drain), self.fanfare
     
     def XiaoBurst(self, time):
         """
         Xiao's Burst HP drain.
         """
-        self.fanfare += self.xiao.drain_curr(0.025)
+        self.fanfare += self.xiao.drain_curr(0.025, self.active)
         return "Xiao HP Drain", self.fanfare
 
     def XiaoE(self, time):
@@ -156,7 +176,7 @@ class XiaoFaruzanFurinaRotation:
         """
         Xiao's High Plunge in Burst.
         """
-        self.plunge += 1
+        self.plunge += self.active
         return "Xiao Plunge {}".format(self.plunge), self.fanfare
     
     def FaruzanBurst(self, time):
@@ -166,24 +186,28 @@ class XiaoFaruzanFurinaRotation:
         """
         C6 Faruzan's Elemental Skill.
         """
-        self.faruzan_skill += 1
+        self.faruzan_skill += self.active
         return "Faruzan Skill {}".format(self.faruzan_skill), self.fanfare
 
-    def FurinaA1(self, on_field_character: Character):
+    def FurinaA1(self, on_field_character: Character, where=True):
         """
         Furina's A1, which heals off-field characters for 2% of their max HP
         if the on field character is overhealed.
         """
-        if on_field_character.current_hp == on_field_character.max_hp:
-            for character in self.characters:
-                if character is not on_field_character:
-                    self.fanfare += character.heal_max(0.02)
+        where = where & (on_field_character.current_hp == on_field_character.max_hp)
+        for character in self.characters:
+            if character is not on_field_character:
+                self.fanfare += character.heal_max(0.02, where)
     
     def add(self, time: float, action):
         """
-        Add an action to the timeline at the given time.
+        Add an action to the timeline at the given time. Actions at the same time
+        run in the order they were added. Actions may add follow-up actions while
+        the rotation runs, but not before the current time.
         """
-        insort(self.timeline, (time, action), key=lambda x: x[0])
+        if self.time is not None and time < self.time:
+            raise ValueError('Cannot add an action at {} before the current time {}'.format(time, self.time))
+        heapq.heappush(self.timeline, (time, next(self._sequence), action))
     
     def generate_timeline(self, xiao_start=7.65):
         """
@@ -242,30 +266,84 @@ class XiaoFaruzanFurinaRotation:
                 return True
         return False
 
-    def run(self):
+    def run(self, verbose: bool = True):
         """
-        Run the rotation and print each action and its Fanfare points.
+        Run the rotation and print each action and its Fanfare points, if verbose.
+        Also records Fanfare and Xiao's HP at each of Xiao's hits in xiao_hits.
         """
+        self.time = None
         self.generate_timeline()
 
         results = []
         hp_timeline = [["Xiao", "Faruzan", "Furina", "Flex"]]
-        for action in self.timeline:
-            action_name, fanfare = action[1](action[0])
+        self.xiao_hits = []
+        while self.timeline:
+            time, _, action = heapq.heappop(self.timeline)
+            self.time = time
+            action_name, fanfare = action(time)
             fanfare = math.floor(min(300.0, fanfare)) if self.furina_burst else 0.0
             if action_name.find("Xiao Plunge") > -1:
                 hp_vals = []
                 for character in self.characters:
                     hp_vals.append(character.current_hp/character.max_hp)
                 hp_timeline.append(hp_vals)
+            if action_name.startswith("Xiao E") or action_name.startswith("Xiao Plunge"):
+                self.xiao_hits.append((math.floor(fanfare), self.xiao.current_hp / self.xiao.max_hp))
             if self.should_print(action_name):
-                results.append("{:.3f} | {}: {} Fanfare".format(action[0], action_name, math.floor(fanfare)))
-            
-        for x in results:
-            print(x)
+                results.append("{:.3f} | {}: {} Fanfare".format(time, action_name, math.floor(fanfare)))
+
+        if verbose:
+            for x in results:
+                print(x)
             
         return results, hp_timeline
 
+    def run_variants(self, num_variants: int, hp_range=None, jitter: float = 0.0, seed=None):
+        """
+        Run num_variants variants of the rotation at once, with HP, Fanfare and
+        action counts held as NumPy arrays of one entry per variant.
+
+        With an hp_range of (low, high), each character starts at a uniformly
+        random % of their max HP in it instead of current_hp. Every action is moved
+        by normally distributed jitter, in seconds, so each variant runs the actions
+        in its own order. Actions at the same time keep the order they were added
+        in. Actions may not add follow-up actions here.
+
+        Returns:
+            Fanfare at each Xiao Plunge, as an array of shape (num_variants, num_plunges).
+        """
+        rng = np.random.default_rng(seed)
+        characters = {id(character): character for character in self.characters + [self.xiao]}
+        for character in characters.values():
+            if hp_range is None:
+                character.current_hp = np.full(num_variants, character.current_hp)
+            else:
+                character.current_hp = character.max_hp * rng.uniform(*hp_range, size=num_variants)
+
+        self.time = None
+        self.generate_timeline()
+        events = [heapq.heappop(self.timeline) for _ in range(len(self.timeline))]
+        actions = [action for _, _, action in events]
+        times = np.array([time for time, _, _ in events]) + rng.normal(0.0, jitter, size=(num_variants, len(events)))
+
+        # A stable sort keeps the timeline order for actions at the same time.
+        order = np.argsort(times, axis=1, kind='stable')
+        num_plunges = sum(action.__name__ == 'XiaoPlunge' for action in actions)
+        fanfare = np.zeros((num_variants, num_plunges))
+
+        # Step k runs each variant's k-th action, one distinct action at a time.
+        for column in order.T:
+            for event in np.unique(column):
+                self.active = column == event
+                actions[event](times[:, event])
+                if self.timeline:
+                    raise ValueError('Actions cannot add follow-up actions when running variants')
+                if actions[event].__name__ == 'XiaoPlunge':
+                    value = np.where(self.furina_burst, np.floor(np.minimum(300.0, self.fanfare)), 0.0)
+                    fanfare[self.active, self.plunge[self.active] - 1] = value[self.active]
+        self.active = True
+        return fanfare
+
 class JeanC0(XiaoFaruzanFurinaRotation):
     """
     Rotation with C0 Jean.
@@ -281,15 +359,15 @@ class JeanC0(XiaoFaruzanFurinaRotation):
         Jean's Burst on-cast heal.
         """
         for character in self.characters:
-            self.fanfare += character.heal(heal_amount)
+            self.fanfare += character.heal(heal_amount, self.active)
         return "Jean Burst", self.fanfare
     
     def JeanBurstTick(self, time, heal_amount=1405.0):
         """
         Jean's Burst heal ticks.
         """
-        self.fanfare += self.xiao.heal(heal_amount)
-        self.FurinaA1(self.xiao)
+        self.fanfare += self.xiao.heal(heal_amount, self.active)
+        self.FurinaA1(self.xiao, self.active)
         return "Jean Tick", self.fanfare
 
     def generate_timeline(self):
@@ -308,12 +386,12 @@ class JeanC4(JeanC0):
     """
     def JeanBurst(self, time):
         for character in self.characters:
-            self.fanfare += character.heal(16847.0)
+            self.fanfare += character.heal(16847.0, self.active)
         return "Jean Burst", self.fanfare
 
     def JeanBurstTick(self, time):
-        self.fanfare += self.xiao.heal(1685.0)
-        self.FurinaA1(self.xiao)
+        self.fanfare += self.xiao.heal(1685.0, self.active)
+        self.FurinaA1(self.xiao, self.active)
         return "Jean Tick", self.fanfare
 
 class Bennett(XiaoFaruzanFurinaRotation):
@@ -337,16 +415,16 @@ class Bennett(XiaoFaruzanFurinaRotation):
         """
         Bennett's Burst heal ticks.
         """
-        self.bennett_tick += 1
+        self.bennett_tick += self.active
+
+        # The first tick heals Bennett, the rest heal Xiao.
+        where = self.active & (self.bennett_tick == 1) & self.bennett.below70()
+        self.fanfare += self.bennett.heal(6835.0, where)
+        self.FurinaA1(self.bennett, where)
 
-        if self.bennett_tick == 1:
-            if self.bennett.below70():
-                self.fanfare += self.bennett.heal(6835.0)
-                self.FurinaA1(self.bennett)
-        else:
-            if self.xiao.below70():
-                self.fanfare += self.xiao.heal(6835.0)
-                self.FurinaA1(self.xiao)
+        where = self.active & (self.bennett_tick != 1) & self.xiao.below70()
+        self.fanfare += self.xiao.heal(6835.0, where)
+        self.FurinaA1(self.xiao, where)
         return "Bennett Tick", self.fanfare
 
     def generate_timeline(self):
@@ -376,13 +454,13 @@ class XianyunC0Crane(XiaoFaruzanFurinaRotation):
     
     def XianyunBurst(self, time, heal=7905.0):
         for character in self.characters:
-            self.fanfare += character.heal(heal)
+            self.fanfare += character.heal(heal, self.active)
         return "Xianyun Burst", self.fanfare
 
     def XianyunBurstTick(self, time, heal_amount_4no=3686.0, heal_amount=3529.0):
-        heal = heal_amount_4no if time < 6.817 + 10.0 else heal_amount
+        heal = _where(time < 6.817 + 10.0, heal_amount_4no, heal_amount)
         for character in self.characters:
-            self.fanfare += character.heal(heal)
+            self.fanfare += character.heal(heal, self.active)
         return "Xianyun Burst Tick", self.fanfare
     
     def generate_timeline(self):
@@ -419,6 +497,8 @@ class XianyunC0CraneXiaoHoma(XianyunC0Crane):
     def __init__(self, current_hp: float = 1.0):
         super().__init__(current_hp)
         self.xiao = Character("Xiao", 21835.0, current_hp)
+        # Characters match by name, so this swaps out the default Xiao.
+        self.characters[self.characters.index(self.xiao)] = self.xiao
 
 class XianyunC0TTDSXiaoHoma(XianyunC0TTDS):
     """
@@ -427,6 +507,8 @@ class XianyunC0TTDSXiaoHoma(XianyunC0TTDS):
     def __init__(self, current_hp: float = 1.0):
         super().__init__(current_hp)
         self.xiao = Character("Xiao", 21835.0, current_hp)
+        # Characters match by name, so this swaps out the default Xiao.
+        self.characters[self.characters.index(self.xiao)] = self.xiao
 
 def output_result_to_file(directory, filename, results):
     """
@@ -448,8 +530,27 @@ def write_csv(directory, filename, data):
         writer = csv.writer(outfile)
         writer.writerows(data)
 
-def main():
-    configs = {
+def _where(condition, x, y):
+    """
+    np.where, but keeps plain Python values when condition is a plain bool.
+    """
+    if isinstance(condition, np.ndarray):
+        return np.where(condition, x, y)
+    return x if condition else y
+
+def _minimum(x, y):
+    """
+    np.minimum, but keeps plain Python values when neither is an array.
+    """
+    if isinstance(x, np.ndarray) or isinstance(y, np.ndarray):
+        return np.minimum(x, y)
+    return min(x, y)
+
+def configs():
+    """
+    Returns a fresh rotation for every team configuration, keyed by name.
+    """
+    return {
         "JeanC0_100": JeanC0(1.0),
         "JeanC0_50": JeanC0(0.5),
         "JeanC4_100": JeanC4(1.0),
@@ -461,11 +562,65 @@ def main():
         "XianyunCrane_Homa": XianyunC0CraneXiaoHoma(1.0),
         "XianyunTTDS_Homa": XianyunC0TTDSXiaoHoma(1.0)
     }
-    for (config_name, rotation) in configs.items():
+
+TeamTables = namedtuple('TeamTables', ['fanfare', 'xiao_hp'])
+
+@lru_cache(maxsize=None)
+def tables(config_name: str):
+    """
+    Returns the TeamTables of a config: Furina's Fanfare and Xiao's HP as a % of
+    max HP at each of Xiao's hits, as tuples indexed like Xiao.num_hits. Each config
+    is only simulated once per process.
+    """
+    rotations = configs()
+    if config_name not in rotations:
+        raise ValueError('Unknown Furina config: {}'.format(config_name))
+    rotation = rotations[config_name]
+    rotation.run(verbose=False)
+    fanfare, xiao_hp = zip(*rotation.xiao_hits)
+    return TeamTables(fanfare, xiao_hp)
+
+def main():
+    for (config_name, rotation) in configs().items():
         print(f"\n{config_name}")
         results, hp_timeline = rotation.run()
         output_result_to_file("fanfare", config_name, results)
         write_csv("hp", config_name, hp_timeline)
 
+def sweep(num_variants: int = 10000, hp_range=None, jitter: float = 0.1, seed: int = 0, percentiles=(5, 25, 50, 75, 95)):
+    """
+    Run num_variants variants of every config (see run_variants) and write the
+    distribution of Fanfare at each Xiao Plunge to fanfare_sweep/.
+    """
+    for (config_name, rotation) in configs().items():
+        fanfare = rotation.run_variants(num_variants, hp_range, jitter, seed)
+        table = [["Plunge", "Mean"] + ["P{}".format(q) for q in percentiles]]
+        for plunge in range(fanfare.shape[1]):
+            table.append(
+                [plunge + 1, float(fanfare[:, plunge].mean())] +
+                [float(value) for value in np.percentile(fanfare[:, plunge], percentiles)]
+            )
+
+        print(f"\n{config_name}")
+        print(tabulate(table, headers='firstrow'))
+        write_csv("fanfare_sweep", "{}.csv".format(config_name), table)
+
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Simulate Furina\'s Fanfare for each team config.')
+    parser.add_argument(
+        '--sweep', action='store_true',
+        help='run many variants of each config and write Fanfare distributions to fanfare_sweep/'
+    )
+    parser.add_argument('--variants', type=int, default=10000, help='variants per config')
+    parser.add_argument('--jitter', type=float, default=0.1, help='standard deviation of action timings, in seconds')
+    parser.add_argument(
+        '--hp-range', type=float, nargs=2, metavar=('LOW', 'HIGH'),
+        help='start each character at a random %% of max HP in this range, e.g. 0.5 1.0'
+    )
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+
+    if args.sweep:
+        sweep(args.variants, args.hp_range, args.jitter, args.seed)
+    else:
+        main()
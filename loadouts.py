@@ -0,0 +1,240 @@
+from main import *
+from main import _split_grid
+from teams import DEFAULT_EXCLUSIVE, DEFAULT_POOL, MemoizedBuff, attack_hits, supported, team_name, teams
+from xiao import PeakXiao
+
+import config
+
+from collections import namedtuple
+import heapq
+import numpy as np
+import time
+from tabulate import tabulate
+
+Loadout = namedtuple('Loadout', ['dmg', 'weapon', 'refine', 'artifact', 'team', 'atk', 'crate', 'cdmg'])
+
+# Search tree levels. A node fixes its team, then its artifact set, weapon and
+# refine in turn. Solved nodes hold their exact damage.
+_TEAM, _ARTIFACT, _WEAPON, _REFINE, _SOLVED = range(5)
+
+class LoadoutSearch:
+    """
+    Best-first branch-and-bound search for the top loadouts, i.e. (weapon, refine,
+    artifact set, team) combinations, of a rotation and sub budget.
+
+    Every node of the search tree fixes part of a loadout and is keyed by an
+    optimistic bound of every loadout under it: the damage of a Xiao with the
+    peak stats of any hit of any of its loadouts (see PeakXiao), with the best
+    substat split for those stats. Peak stats are computed once per (weapon,
+    refine, artifact set) and once per buff, then maxed over the parts a node
+    leaves open. Loadouts are only optimized exactly once they are the most
+    promising node, so branches that cannot reach the top K are never expanded.
+
+    Attributes:
+        num_subs: Number of artifact substats.
+        rotation: Rotation of every loadout.
+        weapons: Weapon types, e.g. partials of config.weapon.
+        refines: Weapon refinements.
+        artifact_sets: Artifact set classes.
+        teams: Teams as tuples of buff names.
+        method: Substat optimizer for exact loadouts, see optimize.
+        num_bounds: Number of bounds computed by the last search.
+        num_solved: Number of loadouts optimized by the last search.
+    """
+
+    def __init__(
+        self, num_subs: int, rotation: Rotation, weapons, artifact_sets, teams, refines=range(1, 6),
+        method='vectorized'
+    ):
+        self.num_subs = num_subs
+        self.rotation = rotation
+        self.weapons = list(weapons)
+        self.refines = list(refines)
+        self.artifact_sets = list(artifact_sets)
+        self.teams = [tuple(team) for team in teams]
+        self.method = method
+        self.num_bounds = 0
+        self.num_solved = 0
+
+        names = sorted({name for team in self.teams for name in team})
+        self._buffs = {name: MemoizedBuff(config.buff(name)(rotation=rotation)) for name in names}
+
+        atk, crate, cdmg = _split_grid(num_subs)
+        self._subs = Stats()
+        self._subs.add_artifact_subs(atk=atk, crate=crate, cdmg=cdmg)
+        self._attack_hits = attack_hits(rotation)
+        self._peaks()
+
+    ##################
+    # Public Methods #
+    ##################
+
+    def search(self, k: int = 10):
+        """
+        Returns the top k loadouts, best first.
+        """
+        self.num_bounds = 0
+        self.num_solved = 0
+        team_peaks = [self._team_peak(team) for team in self.teams]
+
+        nodes = []
+        counter = 0
+        for team in range(len(self.teams)):
+            counter += 1
+            node = (_TEAM, team, None, None, None)
+            heapq.heappush(nodes, (-self._bound(node, team_peaks), counter, node, None))
+
+        top = []
+        while nodes and len(top) < k:
+            _, _, node, result = heapq.heappop(nodes)
+            level, team, artifact, weapon, refine = node
+            if level == _SOLVED:
+                top.append(self._loadout(node, result))
+                continue
+            if level == _REFINE:
+                result = self._solve(node)
+                counter += 1
+                heapq.heappush(nodes, (-result[-1], counter, (_SOLVED,) + node[1:], result))
+                continue
+
+            for child in self._children(node):
+                counter += 1
+                heapq.heappush(nodes, (-self._bound(child, team_peaks), counter, child, None))
+        return top
+
+    def num_loadouts(self):
+        """
+        Returns the number of loadouts searched over.
+        """
+        return len(self.teams) * len(self.artifact_sets) * len(self.weapons) * len(self.refines)
+
+    ###################
+    # Private Methods #
+    ###################
+
+    def _peaks(self):
+        """
+        Computes the peak stats of Xiao with every (weapon, refine, artifact set)
+        and no buffs, and their maxima over the parts each search level leaves open.
+        """
+        self._loadout_peaks = {}
+        for artifact, artifact_set in enumerate(self.artifact_sets):
+            for weapon, weapon_type in enumerate(self.weapons):
+                for refine in self.refines:
+                    weapon_instance = weapon_type(refine, rotation=self.rotation)
+                    xiao = PeakXiao(weapon_instance, artifact_set(rotation=self.rotation), [], self.rotation)
+                    xiao.run()
+                    self._loadout_peaks[artifact, weapon, refine] = xiao.peak
+        # Every run has the same hits, so any one can compute bounds.
+        self._xiao = xiao
+
+        self._level_peaks = {}
+        for (artifact, weapon, refine), peak in self._loadout_peaks.items():
+            for key in [(), (artifact,), (artifact, weapon), (artifact, weapon, refine)]:
+                self._level_peaks[key] = self._level_peaks[key].maximum(peak) if key in self._level_peaks else peak
+
+    def _team_peak(self, team):
+        """
+        Returns the sum of the peak stats each of a team's buffs gives at the start
+        of any attack, when dynamic stats are taken.
+        """
+        peak = Stats()
+        for name in team:
+            buff = self._buffs[name]
+            buff_peak = None
+            for num_hits in self._attack_hits:
+                stats = buff.buff(num_hits=num_hits)
+                buff_peak = stats if buff_peak is None else buff_peak.maximum(stats)
+            if buff_peak is not None:
+                peak += buff_peak
+        return peak
+
+    def _bound(self, node, team_peaks):
+        """
+        Returns an upper bound of the damage of every loadout under node.
+        """
+        level, team, artifact, weapon, refine = node
+        key = (artifact, weapon, refine)[:level]
+        self.num_bounds += 1
+        return float(np.max(self._xiao.bound(self._level_peaks[key] + team_peaks[team] + self._subs)))
+
+    def _children(self, node):
+        """
+        Returns the nodes that fix the next part of node's loadouts.
+        """
+        level, team, artifact, weapon, refine = node
+        if level == _TEAM:
+            return [(_ARTIFACT, team, index, None, None) for index in range(len(self.artifact_sets))]
+        if level == _ARTIFACT:
+            return [(_WEAPON, team, artifact, index, None) for index in range(len(self.weapons))]
+        return [(_REFINE, team, artifact, weapon, refine) for refine in self.refines]
+
+    def _solve(self, node):
+        """
+        Optimizes a full loadout's substats. Returns the optimize result.
+        """
+        level, team, artifact, weapon, refine = node
+        self.num_solved += 1
+        return optimize(
+            self.num_subs, self.artifact_sets[artifact], self.weapons[weapon](refine, rotation=self.rotation),
+            [self._buffs[name] for name in self.teams[team]], self.rotation, method=self.method
+        )
+
+    def _loadout(self, node, result):
+        level, team, artifact, weapon, refine = node
+        atk, crate, cdmg, dmg = result
+        return Loadout(
+            dmg, str(self.weapons[weapon](refine=1)), refine, self.artifact_sets[artifact].__name__,
+            self.teams[team], atk, crate, cdmg
+        )
+
+
+if __name__ == '__main__':
+    """
+    Finds the top loadouts over the configured weapons, refines and artifact sets,
+    and every legal team of buffs (see teams.py), or the combos given with --buffs.
+    Takes the same filters as main.py.
+    """
+    parser = config.argument_parser()
+    parser.description = 'Find the top Xiao loadouts of weapon, refine, artifact set and team.'
+    parser.add_argument('--top', type=int, default=10, help='number of loadouts to find (default: 10)')
+    parser.add_argument('--pool', help='buffs to build teams from, e.g. Bennett-Noblesse-FaruzanC6. Default: every buff')
+    parser.add_argument('--size', type=int, default=4, help='maximum number of buffs per team (default: 4)')
+    parser.add_argument(
+        '--exclusive', action='append',
+        help='buffs no team may have more than one of, e.g. TTDS-TTDSXianyun. Added to the default groups'
+    )
+    args = parser.parse_args()
+    selected = config.select(config.load(args.config), args)
+
+    pool = args.pool.replace(',', '-').split('-') if args.pool else DEFAULT_POOL
+    exclusive = DEFAULT_EXCLUSIVE + tuple(tuple(group.replace(',', '-').split('-')) for group in args.exclusive or [])
+
+    for rotation in selected['rotations']:
+        if args.buffs:
+            team_list = [[buff_type.__name__ for buff_type in combo] for combo in selected['buff_combos']]
+        else:
+            # Only buffs that support the rotation make teams.
+            team_list = list(teams(supported(pool, rotation), args.size, exclusive))
+        for num_subs in selected['num_subs']:
+            start = time.perf_counter()
+            loadout_search = LoadoutSearch(
+                num_subs, rotation, selected['weapons'], selected['artifact_sets'], team_list,
+                selected['refines'], selected['method']
+            )
+            top = loadout_search.search(args.top)
+            elapsed = time.perf_counter() - start
+
+            print('\nNum Subs: {}'.format(num_subs))
+            print('Rotation: {}'.format(str(rotation)))
+            print('Optimized {} of {} loadouts, {} bounds, in {:.1f}s'.format(
+                loadout_search.num_solved, loadout_search.num_loadouts(), loadout_search.num_bounds, elapsed
+            ))
+            print(tabulate(
+                [
+                    [rank, loadout.weapon, 'R{}'.format(loadout.refine), loadout.artifact, team_name(loadout.team),
+                     loadout.atk, loadout.crate, loadout.cdmg, loadout.dmg]
+                    for rank, loadout in enumerate(top, 1)
+                ],
+                headers=['Rank', 'Weapon', 'Refine', 'Artifact', 'Team', 'atk', 'crate', 'cdmg', 'DMG']
+            ))
@@ -2,33 +2,35 @@ from artifacts import *
 from buffs import *
 from rotations import *
 from weapons import *
-from xiao import Xiao
+from xiao import GradientXiao, HitPlan, HitTrace, Xiao
 
-import csv
+from cache import CellCache, cell_key
+import config
+from dual import Dual
+import furina
+import profiling
+from results import COLUMNS, ResultsStore
+import xiao
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from functools import partial
+import csv
+import heapq
+import itertools
+import math
+import numpy as np
 import os
-from tabulate import tabulate
 
-def rotation_dmg(weapon: Weapon, artifact: Artifact, buffs, rotation: str, verbose=False):
+def rotation_dmg(weapon: Weapon, artifact: Artifact, buffs, rotation: str, verbose=False, plan: HitPlan = None):
     """
-    Calculates Xiao's total damage over the given rotation.
+    Calculates Xiao's total damage over the given rotation. Pass the same plan to
+    every call with the same weapon, artifact set, buffs and rotation to reuse
+    their dynamic stats.
     """
-    xiao = Xiao(weapon, artifact, buffs, rotation)
-
-    if isinstance(rotation, EE12HP):
-        xiao.skill()
-        xiao.skill()
-        xiao.burst()
-        for i in range(1, 13):
-            xiao.high_plunge()
-    elif isinstance(rotation, EE8N1CJP):
-        xiao.skill()
-        xiao.skill()
-        xiao.burst()
-        for i in range(1, 9):
-            xiao.n1()
-            xiao.ca()
-            xiao.high_plunge()
+    xiao = Xiao(weapon, artifact, buffs, rotation, plan)
+    xiao.run()
 
     if verbose:
         print('Weapon: {} R{}'.format(weapon, weapon.refine))
@@ -37,24 +39,51 @@ def rotation_dmg(weapon: Weapon, artifact: Artifact, buffs, rotation: str, verbo
 
     return xiao.total_damage
 
-def optimize(num_subs: int, artifact_set, weapon: Weapon, buffs, rotation: str, verbose=False):
+def optimize(
+    num_subs: int, artifact_set, weapon: Weapon, buffs, rotation: str, verbose=False,
+    method='brute', verify=False, start=None, rolls='max', step=1
+):
     """
     Optimize rotation damage across all substat combinations for given
     artifact set, weapon, and buffs.
 
+    Args:
+        method: 'brute' evaluates each substat split one at a time, 'vectorized'
+            evaluates the whole split grid at once as NumPy arrays, 'search' runs
+            a guided search that only evaluates a fraction of the splits, 'warm'
+            runs a branch and bound that certifies the optimum, seeded by start,
+            'continuous' optimizes over real valued splits and rounds the result.
+        verify: Only used by 'search' and 'warm'. Cross-checks the result against
+            brute force.
+        start: Only used by 'warm'. (atk, crate, cdmg) split to start from, usually
+            the optimum of a neighbouring chart cell, or the WarmStart a neighbour's
+            search left, see _warm_search.
+        rolls: Only used by 'continuous'. 'max' or 'mean' roll value per sub.
+        step: Only used by 'continuous'. Granularity of the returned split in
+            subs, e.g. 0.5 for half rolls.
+
     Returns:
         (atk, crate, cdmg, max_dmg): optimal substat distribution and damage
     """
+    if method == 'vectorized':
+        return _optimize_vectorized(num_subs, artifact_set, weapon, buffs, rotation, verbose)
+    elif method == 'search':
+        return _optimize_search(num_subs, artifact_set, weapon, buffs, rotation, verbose, verify)
+    elif method == 'warm':
+        return _optimize_warm(num_subs, artifact_set, weapon, buffs, rotation, start, verbose, verify)
+    elif method == 'continuous':
+        return _optimize_continuous(num_subs, artifact_set, weapon, buffs, rotation, rolls, step, verbose)
+    elif method != 'brute':
+        raise ValueError('Unknown optimization method: {}'.format(method))
+
     max_dmg = -1
     max_subs = ()
+    xiao = Xiao(weapon, artifact_set(rotation=rotation), buffs, rotation)
     for crate in range(0, num_subs + 1):
         for cdmg in range(0, num_subs - crate + 1):
             atk = num_subs - crate - cdmg
 
-            artifact = artifact_set(rotation=rotation)
-            artifact.base_stats.add_artifact_subs(atk=atk, crate=crate, cdmg=cdmg)
-
-            dmg = rotation_dmg(weapon, artifact, buffs, rotation)
+            dmg = _run_split(xiao, (atk, crate, cdmg))
             if verbose:
                 print('atk: {}, crate: {}, cdmg: {}, dmg: {}'.format(atk, crate, cdmg, dmg))
             if dmg > max_dmg:
@@ -62,140 +91,855 @@ def optimize(num_subs: int, artifact_set, weapon: Weapon, buffs, rotation: str,
                 max_subs = (atk, crate, cdmg, max_dmg)
     return max_subs
 
-def write_csv(directory, filename, data):
+# Substats marginals returns the damage per sub of, in order.
+MARGINAL_SUBS = ('atk', 'crate', 'cdmg', 'hp', 'em', 'er')
+
+def marginals(split, artifact_set, weapon: Weapon, buffs, rotation: str):
+    """
+    Returns the exact partial derivatives of rotation damage with respect to the
+    number of subs of each of MARGINAL_SUBS, at an (atk, crate, cdmg) split. Each
+    is the damage one more sub is worth, to first order. Rotation damage is
+    computed once, with dual numbers (see Dual) as the substat counts.
+    """
+    counts = dict(zip(MARGINAL_SUBS, tuple(split) + (0, 0, 0)))
+    subs = {
+        name: Dual.variable(counts[name], index, len(MARGINAL_SUBS)) for index, name in enumerate(MARGINAL_SUBS)
+    }
+    artifact = artifact_set(rotation=rotation)
+    artifact.base_stats.add_artifact_subs(**subs)
+
+    dmg = rotation_dmg(weapon, artifact, buffs, rotation)
+    return tuple(float(derivative) for derivative in dmg.grad)
+
+def hit_trace(split, artifact_set, weapon: Weapon, buffs, rotation: str) -> HitTrace:
+    """
+    Returns the per-hit damage breakdown of the rotation at an (atk, crate, cdmg)
+    split, see HitTrace.
+    """
+    atk, crate, cdmg = split
+    artifact = artifact_set(rotation=rotation)
+    artifact.base_stats.add_artifact_subs(atk=atk, crate=crate, cdmg=cdmg)
+
+    xiao = Xiao(weapon, artifact, buffs, rotation, trace=True)
+    xiao.run()
+    return xiao.trace
+
+def _split_grid(num_subs: int):
+    """
+    Returns every (atk, crate, cdmg) split of num_subs as three NumPy arrays,
+    in the same order the brute force optimizer visits them.
+    """
+    crate, cdmg = np.array(
+        [(crate, cdmg) for crate in range(0, num_subs + 1) for cdmg in range(0, num_subs - crate + 1)]
+    ).T
+    atk = num_subs - crate - cdmg
+    return atk, crate, cdmg
+
+def _optimize_vectorized(num_subs: int, artifact_set, weapon: Weapon, buffs, rotation: str, verbose=False):
+    """
+    Optimize rotation damage by evaluating every substat split in one pass. Each
+    substat is an array with one entry per split, so the rotation damage comes
+    back as an array as well.
+
+    If weapon.refine is a column of refinements, e.g. np.arange(1, 6)[:, None],
+    every refinement is optimized in the same pass along the first axis, and a
+    list with the result of each refinement is returned instead.
+    """
+    atk, crate, cdmg = _split_grid(num_subs)
+
+    artifact = artifact_set(rotation=rotation)
+    artifact.base_stats.add_artifact_subs(atk=atk, crate=crate, cdmg=cdmg)
+
+    dmg = rotation_dmg(weapon, artifact, buffs, rotation)
+    if not np.ndim(weapon.refine):
+        return _best_split(atk, crate, cdmg, dmg, verbose)
+
+    # Weapons without refine dependent values come back with a single row.
+    dmg = np.broadcast_to(dmg, (len(weapon.refine), len(atk)))
+    return [_best_split(atk, crate, cdmg, refine_dmg, verbose) for refine_dmg in dmg]
+
+def _best_split(atk, crate, cdmg, dmg, verbose=False):
+    """
+    Returns the (atk, crate, cdmg, max_dmg) split with the highest damage of a
+    split grid and its damage array.
+    """
+    if verbose:
+        for split in zip(atk, crate, cdmg, dmg):
+            print('atk: {}, crate: {}, cdmg: {}, dmg: {}'.format(*split))
+
+    # argmax returns the first maximum, matching the brute force tie-break.
+    best = int(np.argmax(dmg))
+    return (int(atk[best]), int(crate[best]), int(cdmg[best]), float(dmg[best]))
+
+def _run_split(xiao: Xiao, split, add_subs=Stats.add_artifact_subs):
+    """
+    Resets xiao, whose artifact set has no subs, to an (atk, crate, cdmg) split of
+    subs added with add_subs, then returns its rotation damage. Lets one Xiao
+    evaluate every split of a chart cell.
+    """
+    atk, crate, cdmg = split
+    subs = Stats()
+    add_subs(subs, atk=atk, crate=crate, cdmg=cdmg)
+    return xiao.reset(subs).run()
+
+def _split_dmg(split, xiao: Xiao, cache):
+    """
+    Returns the rotation damage for an (atk, crate, cdmg) split, memoized in cache.
+    """
+    if split not in cache:
+        cache[split] = _run_split(xiao, split)
+    return cache[split]
+
+def _crate_cap(num_subs: int, xiao: Xiao, cache, guess=None):
+    """
+    Returns the fewest crit rate subs that put every hit at 100% crit rate.
+
+    Xiao._dmgcalc clamps crit rate at 100%, so once every hit is capped another
+    crit rate sub no longer changes damage and any split with more crit rate
+    subs is beaten by moving the extra subs into crit damage.
+
+    With a guess, e.g. the cap of a neighbouring chart cell, the search gallops
+    outward from it, so a right guess is confirmed in three evaluations.
+    """
+    def capped(crate):
+        # Capped iff one more crit rate sub changes nothing.
+        return _split_dmg((0, crate, 0), xiao, cache) == _split_dmg((0, crate + 1, 0), xiao, cache)
+
+    low, high = 0, num_subs
+    if guess is not None:
+        # Gallop away from guess in doubling steps until the cap is bracketed.
+        step = 1
+        if guess >= num_subs or capped(guess):
+            high = min(guess, num_subs)
+            while high - step >= low:
+                if not capped(high - step):
+                    low = high - step + 1
+                    break
+                high -= step
+                step *= 2
+        else:
+            low = guess + 1
+            while low + step - 1 < high:
+                if capped(low + step - 1):
+                    high = low + step - 1
+                    break
+                low += step
+                step *= 2
+
+    # Binary search for the first capped crate, since capped() is monotonic.
+    while low < high:
+        mid = (low + high) // 2
+        if capped(mid):
+            high = mid
+        else:
+            low = mid + 1
+    return low
+
+def _optimize_search(num_subs: int, artifact_set, weapon: Weapon, buffs, rotation: str, verbose=False, verify=False):
+    """
+    Optimize rotation damage without enumerating every substat split.
+
+    Subs are first allocated greedily, one at a time, to whichever stat gives the
+    largest marginal gain. The split is then refined by hill climbing: move one sub
+    between two stats while that improves damage. Splits over the crit rate cap
+    are dominated and never visited.
+    """
+    cache = {}
+    args = (Xiao(weapon, artifact_set(rotation=rotation), buffs, rotation), cache)
+    crate_cap = _crate_cap(num_subs, *args)
+
+    def key(split):
+        # Rank by damage, then prefer the split brute force would visit first.
+        return (_split_dmg(split, *args), -split[1], -split[2])
+
+    split = _hill_climb(_greedy_split(num_subs, crate_cap, key), crate_cap, key)
+
+    atk, crate, cdmg = split
+    max_dmg = _split_dmg(split, *args)
+    if verbose:
+        print('Evaluated {} splits, crate cap: {}'.format(len(cache), crate_cap))
+        print('atk: {}, crate: {}, cdmg: {}, dmg: {}'.format(atk, crate, cdmg, max_dmg))
+
+    if verify:
+        _verify('Search', (atk, crate, cdmg, max_dmg), num_subs, artifact_set, weapon, buffs, rotation)
+    return (atk, crate, cdmg, max_dmg)
+
+def _optimize_warm(
+    num_subs: int, artifact_set, weapon: Weapon, buffs, rotation: str, start=None, verbose=False, verify=False
+):
+    """
+    Optimize rotation damage starting from a nearby split, e.g. the optimum of the
+    same weapon at the previous refine, see _warm_search.
+    """
+    result, _ = _warm_search(num_subs, artifact_set, weapon, buffs, rotation, start, verbose)
+    if verify:
+        _verify('Warm start', result, num_subs, artifact_set, weapon, buffs, rotation)
+    return result
+
+# What a solved cell passes on to warm start its neighbours: its optimal split,
+# number of subs, crit rate cap and the boxes that certified its optimum.
+WarmStart = namedtuple('WarmStart', ['split', 'num_subs', 'crate_cap', 'boxes'])
+
+def _warm_search(num_subs: int, artifact_set, weapon: Weapon, buffs, rotation: str, start=None, verbose=False):
+    """
+    Returns the optimal (atk, crate, cdmg, max_dmg) and the WarmStart it leaves
+    for the next cell. start is a split, a neighbour's WarmStart or None.
+
+    The optimum is certified by branch and bound over boxes of (crate, cdmg)
+    splits. Damage never drops when any substat gets another sub, so no split in
+    a box beats the damage of its optimistic corner: the box's most atk, crate
+    and cdmg subs at once. Boxes are searched best bound first and the search
+    stops as soon as no box can beat the best split found.
+
+    The start split is the first incumbent. A WarmStart also seeds the crit rate
+    cap search and the boxes: the neighbour's final boxes, which tile the splits
+    and nearly all fall short of its optimum, are bounded as they are instead of
+    halving the whole grid down to them again. Close neighbours have close
+    damage, so most are pruned on their first evaluation.
+
+    Only monotonicity is assumed, so the bound stays loose wherever many splits
+    come close to the optimum, e.g. without buffs. There a seeded cell can take
+    more evaluations than 'search', and an unseeded one usually does. 'warm' pays
+    off over whole chains of close cells (see _solve_chain), not per cell.
+    """
+    cache = {}
+    args = (Xiao(weapon, artifact_set(rotation=rotation), buffs, rotation), cache)
+    if start is not None and not isinstance(start, WarmStart):
+        start = WarmStart(start, None, None, None)
+    guess = None if start is None else start.crate_cap if start.crate_cap is not None else start.split[1]
+    crate_cap = _crate_cap(num_subs, *args, guess=guess)
+
+    def key(split):
+        # Rank by damage, then prefer the split brute force would visit first.
+        return (_split_dmg(split, *args), -split[1], -split[2])
+
+    if start is None:
+        crate = min(crate_cap, num_subs // 2)
+        best = (0, crate, num_subs - crate)
+    else:
+        # Neighbours may have a different number of subs, e.g. with extra ER subs.
+        crate = min(start.split[1], crate_cap, num_subs)
+        cdmg = min(start.split[2], num_subs - crate)
+        best = (num_subs - crate - cdmg, crate, cdmg)
+    max_dmg = _split_dmg(best, *args)
+
+    def bound(box):
+        crate_low, crate_high, cdmg_low, cdmg_high = box
+        return _split_dmg((num_subs - crate_low - cdmg_low, crate_high, cdmg_high), *args)
+
+    boxes = []
+    if start is None or start.num_subs != num_subs:
+        _push_box(boxes, (0, crate_cap, 0, num_subs), num_subs, bound)
+    else:
+        for crate_low, crate_high, cdmg_low, cdmg_high in start.boxes:
+            _push_box(boxes, (crate_low, min(crate_high, crate_cap), cdmg_low, cdmg_high), num_subs, bound)
+        if start.crate_cap < crate_cap:
+            _push_box(boxes, (start.crate_cap + 1, crate_cap, 0, num_subs), num_subs, bound)
+
+    leaves = []
+    while boxes and -boxes[0][0] >= max_dmg:
+        _, box = heapq.heappop(boxes)
+        crate_low, crate_high, cdmg_low, cdmg_high = box
+        if crate_low == crate_high and cdmg_low == cdmg_high:
+            split = (num_subs - crate_low - cdmg_low, crate_low, cdmg_low)
+            if key(split) > key(best):
+                best, max_dmg = split, _split_dmg(split, *args)
+            leaves.append(box)
+            continue
+
+        # Halve the box along its longer side.
+        if crate_high - crate_low >= cdmg_high - cdmg_low:
+            mid = (crate_low + crate_high) // 2
+            halves = [(crate_low, mid, cdmg_low, cdmg_high), (mid + 1, crate_high, cdmg_low, cdmg_high)]
+        else:
+            mid = (cdmg_low + cdmg_high) // 2
+            halves = [(crate_low, crate_high, cdmg_low, mid), (crate_low, crate_high, mid + 1, cdmg_high)]
+        for half in halves:
+            _push_box(boxes, half, num_subs, bound)
+    leaves.extend(box for _, box in boxes)
+
+    atk, crate, cdmg = best
+    if verbose:
+        print('Evaluated {} splits, crate cap: {}, start: {}'.format(
+            len(cache), crate_cap, None if start is None else start.split
+        ))
+        print('atk: {}, crate: {}, cdmg: {}, dmg: {}'.format(atk, crate, cdmg, max_dmg))
+    return (atk, crate, cdmg, max_dmg), WarmStart(best, num_subs, crate_cap, leaves)
+
+def _push_box(boxes, box, num_subs: int, bound):
+    """
+    Shrinks a box of (crate_low, crate_high, cdmg_low, cdmg_high) to the splits of
+    num_subs it contains and pushes it onto the boxes heap, best bound first.
+    Empty boxes are dropped.
+    """
+    crate_low, crate_high, cdmg_low, cdmg_high = box
+    crate_high = min(crate_high, num_subs - cdmg_low)
+    cdmg_high = min(cdmg_high, num_subs - crate_low)
+    if crate_low > crate_high or cdmg_low > cdmg_high:
+        return
+    box = (crate_low, crate_high, cdmg_low, cdmg_high)
+    heapq.heappush(boxes, (-bound(box), box))
+
+def _greedy_split(num_subs: int, crate_cap: int, key):
+    """
+    Allocates subs one at a time to whichever stat ranks highest by key.
+    """
+    split = (0, 0, 0)
+    for _ in range(num_subs):
+        candidates = [(split[0] + 1, split[1], split[2]), (split[0], split[1], split[2] + 1)]
+        if split[1] < crate_cap:
+            candidates.append((split[0], split[1] + 1, split[2]))
+        split = max(candidates, key=key)
+    return split
+
+def _hill_climb(split, crate_cap: int, key):
+    """
+    Moves one sub between two stats while that improves key, and returns the
+    local optimum.
+    """
+    while True:
+        neighbours = []
+        for source in range(3):
+            for target in range(3):
+                if source == target or split[source] == 0:
+                    continue
+                neighbour = list(split)
+                neighbour[source] -= 1
+                neighbour[target] += 1
+                if neighbour[1] <= crate_cap:
+                    neighbours.append(tuple(neighbour))
+        best = max(neighbours, key=key, default=split)
+        if key(best) <= key(split):
+            return split
+        split = best
+
+def _verify(name: str, result, num_subs: int, artifact_set, weapon: Weapon, buffs, rotation: str):
+    """
+    Raises a RuntimeError if result is not what brute force finds.
+    """
+    expected = _optimize_vectorized(num_subs, artifact_set, weapon, buffs, rotation)
+    if expected != result:
+        raise RuntimeError('{} found {} but brute force found {} for {} R{}'.format(
+            name, result, expected, weapon, weapon.refine
+        ))
+
+# Stats method adding subs of each roll value.
+_ROLLS = {'max': Stats.add_artifact_subs, 'mean': Stats.add_mean_artifact_subs}
+
+def _optimize_continuous(
+    num_subs: int, artifact_set, weapon: Weapon, buffs, rotation: str, rolls='max', step=1, verbose=False
+):
     """
-    Write data as CSV to specified directory/filename.
+    Optimize rotation damage over real valued substat splits, then round.
+
+    Crit rate caps put kinks in the damage along crit rate only. For a fixed crit
+    rate, damage is concave along the line trading atk for cdmg subs, so its
+    maximum is the root of the analytic derivative from GradientXiao. The crit
+    rate is then found the same way, with the derivative of that line maximum.
+    Both roots are found to a hundredth of a sub. The optimum is then rounded to
+    the best of its neighbouring splits on a grid of step subs, e.g. 0.5 for
+    half rolls, so the cost does not depend on step.
+
+    Like 'search', this assumes the best damage for each crit rate rises and then
+    falls, and the rounded split is not guaranteed to be the best on the grid.
+    """
+    if rolls not in _ROLLS:
+        raise ValueError('Unknown roll value: {}'.format(rolls))
+    add_subs = _ROLLS[rolls]
+    xiao = GradientXiao(weapon, artifact_set(rotation=rotation), buffs, rotation)
+    gradients = {}
+
+    # Stat value of a single sub.
+    unit = Stats()
+    add_subs(unit, atk=1, crate=1, cdmg=1)
+
+    def gradient(split):
+        # Partial derivatives of damage per atk, crate and cdmg sub.
+        if split not in gradients:
+            _run_split(xiao, split, add_subs)
+            gradients[split] = (
+                float(xiao.gradient.atk) * unit.atk,
+                float(xiao.gradient.crate) * unit.crate,
+                float(xiao.gradient.cdmg) * unit.cdmg
+            )
+        return gradients[split]
+
+    def best_cdmg(crate):
+        # Best cdmg subs for a fixed crate, trading them for atk subs.
+        def derivative(cdmg):
+            d_atk, _, d_cdmg = gradient((num_subs - crate - cdmg, crate, cdmg))
+            return d_cdmg - d_atk
+        return _maximize_concave(derivative, 0.0, num_subs - crate)
+
+    def derivative(crate):
+        # Envelope theorem: crate subs come out of atk, or out of cdmg once atk runs out.
+        cdmg = best_cdmg(crate)
+        atk = num_subs - crate - cdmg
+        d_atk, d_crate, d_cdmg = gradient((atk, crate, cdmg))
+        return d_crate - (d_atk if atk > 0 else d_cdmg)
+
+    crate = _maximize_concave(derivative, 0.0, float(num_subs))
+    cdmg = best_cdmg(crate)
+    split = (num_subs - crate - cdmg, crate, cdmg)
+
+    # Round to the best neighbouring split on the grid, without computing gradients.
+    evaluator = Xiao(weapon, xiao.artifact, buffs, rotation, xiao.plan)
+    best = None
+    for crate in sorted({math.floor(split[1] / step) * step, math.ceil(split[1] / step) * step}):
+        for cdmg in sorted({math.floor(split[2] / step) * step, math.ceil(split[2] / step) * step}):
+            atk = num_subs - crate - cdmg
+            if atk < 0:
+                continue
+            dmg = _run_split(evaluator, (atk, crate, cdmg), add_subs)
+            # Ties go to the split brute force would visit first.
+            if best is None or dmg > best[3]:
+                best = (atk, crate, cdmg, dmg)
+
+    if verbose:
+        print('Evaluated {} gradients, continuous optimum: {}'.format(len(gradients), split))
+        print('atk: {}, crate: {}, cdmg: {}, dmg: {}'.format(*best))
+    return best
+
+def _maximize_concave(derivative, low: float, high: float, tolerance=0.01):
+    """
+    Returns the x in [low, high] that maximizes a concave function, to within
+    tolerance, given its derivative. Finds the derivative's root by regula falsi,
+    with the Illinois modification so both ends of the bracket keep moving.
+    """
+    d_low = derivative(low)
+    if d_low <= 0:
+        return low
+    d_high = derivative(high)
+    if d_high >= 0:
+        return high
+
+    x = low
+    side = 0
+    while high - low > tolerance:
+        new = low - d_low * (high - low) / (d_high - d_low)
+        d_new = derivative(new)
+        if d_new > 0:
+            low, d_low = new, d_new
+            if side == 1:
+                d_high /= 2
+            side = 1
+        elif d_new < 0:
+            high, d_high = new, d_new
+            if side == -1:
+                d_low /= 2
+            side = -1
+        else:
+            return new
+        if abs(new - x) < tolerance:
+            return new
+        x = new
+    return (low + high) / 2
+
+def write_csv(directory, filename, data, mode='w'):
+    """
+    Write data as CSV to specified directory/filename. Pass mode='a' to append to it.
     """
     filename = '{}/{}'.format(directory, filename)
     os.makedirs(os.path.dirname(filename), exist_ok=True)
-    with open(filename, "w", encoding='UTF8', newline='') as outfile:
+    with open(filename, mode, encoding='UTF8', newline='') as outfile:
         writer = csv.writer(outfile)
         writer.writerows(data)
 
-def main(num_subs, artifact_set, buff_combos, weapons, rotation, extra_er_subs=False):
+def _solve_cell(cell, start=None):
+    """
+    Optimize a single chart cell. Returns its result and the WarmStart it leaves
+    for its neighbours, None unless the method is 'warm'. See _warm_search for start.
+    """
+    num_subs, artifact_set, weapon, buffs, rotation, method = cell
+    with profiling.cell(lambda: _cell_name(cell)):
+        if method == 'warm':
+            return _warm_search(num_subs, artifact_set, weapon, buffs, rotation, start)
+        return optimize(num_subs, artifact_set, weapon, buffs, rotation, method=method), None
+
+def _solve_chain(cells, with_marginals=False):
+    """
+    Optimize cells one after another, and returns a (result, marginals) pair per
+    cell. marginals is None unless with_marginals is True, see _cell_marginals.
+    Kept at module level so the process pool can pickle it.
+
+    Each cell starts from the WarmStart of its nearest solved neighbour in the
+    chain: the previous refine under the same buffs, or else the same refine under
+    the previous buffs. Only the 'warm' method makes use of it.
+    """
+    results = []
+    previous = None
+    by_refine = {}
+    for cell in cells:
+        num_subs, artifact_set, weapon, buffs, rotation, method = cell
+        if method != 'warm':
+            result = _solve_cell(cell)[0]
+        else:
+            if previous is not None and previous[0] is buffs:
+                start = previous[1]
+            else:
+                start = by_refine.get(weapon.refine)
+
+            result, warm_start = _solve_cell(cell, start)
+            previous = (buffs, warm_start)
+            by_refine[weapon.refine] = warm_start
+        results.append((result, _cell_marginals(cell, result) if with_marginals else None))
+    return results
+
+def _cell_marginals(cell, result):
+    """
+    Returns the marginals (see marginals) at a solved cell's optimum. For the
+    'vectorized' method, which solves a batch of refines, a list of them per refine.
+    """
+    num_subs, artifact_set, weapon, buffs, rotation, method = cell
+    if method != 'vectorized':
+        return marginals(result[:3], artifact_set, weapon, buffs, rotation)
+    return [
+        marginals(refine_result[:3], artifact_set, weapon.refined(int(refine)), buffs, rotation)
+        for refine, refine_result in zip(np.ravel(weapon.refine), result)
+    ]
+
+def _chains(cells, indices):
+    """
+    Groups the cells at indices into chains for _solve_chain, each a list of
+    indices in order. Warm started cells are chained by weapon so they can start
+    from each other. Every other cell is a chain of its own.
+    """
+    chains = {}
+    for index in indices:
+        num_subs, artifact_set, weapon, buffs, rotation, method = cells[index]
+        key = (type(weapon), str(weapon)) if method == 'warm' else index
+        chains.setdefault(key, []).append(index)
+    return list(chains.values())
+
+def _cell_name(cell):
+    """
+    Returns a human readable label for a chart cell.
+    """
+    num_subs, artifact_set, weapon, buffs, rotation, method = cell
+    return '{} R{} | {} | {} | {} | {} subs'.format(
+        weapon, ",".join(map(str, np.ravel(weapon.refine))), artifact_set.__name__, "-".join(map(str, buffs)),
+        rotation, num_subs
+    )
+
+def _solve_cells(cells, workers=1, chunksize=1, cache: CellCache = None, extra_er_subs=False, with_marginals=False):
+    """
+    Yields the optimize result of each cell and its marginals (see _solve_chain), in
+    order. With more than one worker the chains of cells (see _chains) are fanned
+    out to a process pool, unless profiling, which only sees this process. With a
+    cache, cached cells are served from it and only the rest are solved. Entries
+    cached without marginals count as misses if with_marginals is True.
+    """
+    keys = [_cell_key(cell, extra_er_subs) for cell in cells] if cache else [None] * len(cells)
+    cached = [cache.get(key) if cache else None for key in keys]
+    if with_marginals:
+        cached = [entry if entry is None or entry['marginals'] is not None else None for entry in cached]
+    chains = _chains(cells, [index for index, hit in enumerate(cached) if hit is None])
+    tasks = [[cells[index] for index in chain] for chain in chains]
+    solve_chain = partial(_solve_chain, with_marginals=with_marginals)
+
+    if workers <= 1 or not tasks or profiling.is_active():
+        solved = _in_order(chains, map(solve_chain, tasks))
+        yield from _merge_cached(keys, cached, solved, cache)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # map yields results in submission order, so output stays deterministic.
+        solved = _in_order(chains, executor.map(solve_chain, tasks, chunksize=chunksize))
+        yield from _merge_cached(keys, cached, solved, cache)
+
+def _in_order(chains, solved):
+    """
+    Yields the results of every chain's cells in index order, as soon as the chain
+    holding the next index is solved.
     """
-    Generate charts for the given parameters.
+    done = {}
+    batches = zip(chains, solved)
+    for index in sorted(index for chain in chains for index in chain):
+        while index not in done:
+            chain, results = next(batches)
+            done.update(zip(chain, results))
+        yield done.pop(index)
+
+def _merge_cached(keys, cached, solved, cache: CellCache):
+    """
+    Yields cached (result, marginals) pairs, taking the next solved pair for each
+    miss and caching it.
     """
-    for buff_types in buff_combos:
-        # Convert buff_types into buff instances.
-        buffs = [buff_type(rotation=rotation) for buff_type in buff_types]
+    for key, entry in zip(keys, cached):
+        if entry is None:
+            result, cell_marginals = next(solved)
+            if cache:
+                cache.put(key, {'result': list(result), 'marginals': cell_marginals})
+        else:
+            result, cell_marginals = entry['result'], entry['marginals']
+        yield tuple(result), cell_marginals
 
-        # Output.
-        weapon_chart = [["Weapon", "R1", "R2", "R3", "R4", "R5"]]
-        optimal_substats = [['weapon', 'refine', 'atk', 'crate', 'cdmg']]
-        
+def _cell_key(cell, extra_er_subs):
+    """
+    Returns the cache key of a chart cell.
+    """
+    num_subs, artifact_set, weapon, buffs, rotation, method = cell
+    config = {
+        'num_subs': num_subs,
+        'extra_er_subs': extra_er_subs,
+        'artifact_set': artifact_set,
+        'weapon': weapon,
+        'buffs': buffs,
+        'rotation': rotation,
+        'method': method
+    }
+    return cell_key(config, sources=_ENGINE_SOURCES)
+
+# Functions a cached result and its marginals depend on besides the weapon, artifact, buff and rotation classes.
+# The Furina simulator feeds Furina's buffs and Homa. The whole xiao module is fingerprinted
+# so edits to its action compiler or the talent modifiers in ATTACKS invalidate cached cells.
+_ENGINE_SOURCES = (
+    Stats, HitPlan, Xiao, rotation_dmg, optimize, _split_grid, _optimize_vectorized, _best_split, _split_dmg,
+    _crate_cap, _optimize_search, _optimize_warm, _warm_search, _push_box, _greedy_split, _hill_climb,
+    _optimize_continuous, _maximize_concave, GradientXiao, _run_split, marginals, _cell_marginals, Dual,
+    furina, xiao
+)
+
+def solve_charts(
+    num_subs, artifact_set, buff_lists, weapons, rotation, extra_er_subs=False,
+    method='vectorized', workers=1, chunksize=1, cache: CellCache = None, refines=range(1, 6), positions=None,
+    with_marginals=False
+):
+    """
+    Yields a row of every (buffs, weapon, refine) cell of the given charts, in chart
+    order, in the layout of results.COLUMNS. buff_lists holds buff instances and
+    weapons holds weapon types, e.g. partials of config.weapon. See main for how
+    cells are solved. positions holds each weapon's place in the full configured
+    chart, so charts computed a few weapons at a time stay in order. Default: the
+    weapons' order. If with_marginals is True, yields (row, marginals) pairs instead,
+    with the marginals (see marginals) at the row's optimum computed alongside it.
+    """
+    cells = []
+    for buffs in buff_lists:
         for weapon in weapons:
+            for cell_subs, cell_refines in _refine_batches(num_subs, weapon, rotation, extra_er_subs, method, refines):
+                # The vectorized optimizer solves a batch of refines along the first axis.
+                refine = np.array(cell_refines)[:, None] if method == 'vectorized' else cell_refines[0]
+                cells.append((cell_subs, artifact_set, weapon(refine, rotation=rotation), buffs, rotation, method))
+    results = _solve_cells(cells, workers, chunksize, cache, extra_er_subs, with_marginals)
+    artifact_name = str(artifact_set(rotation))
+
+    if positions is None:
+        positions = range(len(weapons))
+
+    for buffs in buff_lists:
+        buff_names = [str(buff) for buff in buffs]
+        for position, weapon in zip(positions, weapons):
             weapon_name = str(weapon(refine=1))
-            row = [weapon_name]
-            for refine in range(1, 6):
-                # Give ER weapons 5 extra subs.
-                bonus_subs = 0
-                if extra_er_subs and weapon(refine=refine, rotation=rotation).base_stats.er > 0:
-                    bonus_subs = 5
+            solved = {}
+            for cell_subs, cell_refines in _refine_batches(num_subs, weapon, rotation, extra_er_subs, method, refines):
+                result, cell_marginals = next(results)
+                if method != 'vectorized':
+                    result, cell_marginals = [result], [cell_marginals]
+                elif cell_marginals is None:
+                    cell_marginals = [None] * len(cell_refines)
+                solved.update(zip(cell_refines, zip(result, cell_marginals)))
 
+            for refine in refines:
                 # Get optimal substat distribution and max damage.
-                atk, crate, cdmg, dmg = optimize(
-                    num_subs + bonus_subs,
-                    artifact_set,
-                    weapon(refine, rotation=rotation),
-                    buffs,
-                    rotation
+                (atk, crate, cdmg, dmg), row_marginals = solved[refine]
+                row = [
+                    num_subs, str(rotation), artifact_name, extra_er_subs, buff_names, weapon_name,
+                    refine, position, atk, crate, cdmg, dmg
+                ]
+                yield (row, row_marginals) if with_marginals else row
+
+def _refine_batches(num_subs: int, weapon, rotation, extra_er_subs: bool, method: str, refines):
+    """
+    Returns the (num_subs, refines) of each cell solve_charts solves for a weapon
+    type. The 'vectorized' method solves every refine with the same number of subs
+    in one cell, every other method solves one refine per cell.
+    """
+    batches = {}
+    for refine in refines:
+        # Give ER weapons 5 extra subs.
+        bonus_subs = 0
+        if extra_er_subs and weapon(refine=refine, rotation=rotation).base_stats.er > 0:
+            bonus_subs = 5
+        key = num_subs + bonus_subs if method == 'vectorized' else (num_subs + bonus_subs, refine)
+        batches.setdefault(key, (num_subs + bonus_subs, []))[1].append(refine)
+    return list(batches.values())
+
+def main(
+    num_subs, artifact_set, buff_combos, weapons, rotation, extra_er_subs=False,
+    method='vectorized', workers=1, chunksize=1, cache: CellCache = None,
+    refines=range(1, 6), write=True, store: ResultsStore = None, trace=False, positions=None
+):
+    """
+    Generate charts for the given parameters. See optimize for the available methods.
+
+    Every (buff combo, weapon, refine) cell is independent, so with workers > 1 they
+    are solved on a process pool, chunksize cells at a time. The 'vectorized' method
+    solves all refines of a weapon in one cell. With the 'warm' method,
+    each weapon's cells are solved in order so each starts from a neighbouring
+    cell's optimum, and the pool gets chunksize weapons at a time. Output is
+    identical to a serial run. Cells found in cache are not recomputed. Only the given refines
+    are computed, and charts are only saved if write is True: to store if given, else as
+    CSVs. Saved charts come with the marginal value of each sub at every cell's optimum,
+    see marginals, computed and cached with the cell. If trace is True, the per-hit damage breakdown of every cell's optimum
+    is saved as a CSV under traces/, see hit_trace. See solve_charts for positions.
+
+    Charts are streamed (see stream_charts): each weapon row is printed and saved as
+    soon as it is solved, so nothing already solved is lost if a run is interrupted.
+    """
+    # Convert buff_types into buff instances.
+    buff_lists = [[buff_type(rotation=rotation) for buff_type in buff_types] for buff_types in buff_combos]
+    charts = iter(buff_lists)
+
+    artifact_name = str(artifact_set(rotation))
+    weapon_names = [str(weapon(refine=1)) for weapon in weapons]
+    header = ["Weapon"] + ['R{}'.format(refine) for refine in refines]
+    widths = [max(map(len, weapon_names + ["Weapon"]))] + [_DMG_WIDTH] * len(refines)
+
+    rows = stream_charts(
+        num_subs, artifact_set, buff_lists, weapons, rotation, extra_er_subs, method, workers, chunksize,
+        cache, refines, positions, with_marginals=write
+    )
+    for index, weapon_rows in enumerate(rows):
+        if write:
+            # Marginals are computed with the cells, by the workers.
+            weapon_rows, weapon_marginals = map(list, zip(*weapon_rows))
+        else:
+            weapon_marginals = [None] * len(weapon_rows)
+
+        # Charts come one after the other, each with every weapon in order.
+        index %= len(weapons)
+        weapon = weapons[index]
+        weapon_name = weapon_names[index]
+
+        if index == 0:
+            # Start a new chart.
+            buffs = next(charts)
+            buff_names = "-".join(map(str, buffs))
+            chart_filename = 'num_subs={}/rotation={}/artifact={}/with_er={}/{}.csv'.format(
+                num_subs, str(rotation), artifact_name, extra_er_subs, buff_names
+            )
+            substats_filename = 'num_subs={}/artifact={}/with_er={}/{}.csv'.format(
+                num_subs, artifact_name, extra_er_subs, buff_names
+            )
+
+            # Print the chart's header to stdout.
+            print('\nNum Subs: {}'.format(num_subs))
+            print('Rotation: {}'.format(str(rotation)))
+            print('Artifact: {}'.format(artifact_name))
+            print('With ER: {}'.format(extra_er_subs))
+            print('Buffs: [{}]'.format(", ".join(map(str, buffs))))
+            print(_chart_line(header, widths))
+            print(_chart_line(['-' * width for width in widths], widths), flush=True)
+
+            # Start the chart's CSVs, overwriting any previous run's.
+            if write and not store:
+                write_csv('charts', chart_filename, [header])
+                write_csv('substats', substats_filename, [['weapon', 'refine', 'atk', 'crate', 'cdmg']])
+                write_csv('marginals', substats_filename, [['weapon', 'refine'] + list(MARGINAL_SUBS)])
+
+        chart_row = [weapon_name]
+        optimal_substats = []
+        marginal_substats = []
+        for row, row_marginals in zip(weapon_rows, weapon_marginals):
+            refine = row[COLUMNS.index('refine')]
+            atk, crate, cdmg, dmg = row[-4:]
+            chart_row.append(dmg)
+            optimal_substats.append([weapon_name, 'R{}'.format(refine), atk, crate, cdmg])
+            if write:
+                marginal_substats.append([weapon_name, 'R{}'.format(refine)] + list(row_marginals))
+            if trace:
+                filename = 'num_subs={}/rotation={}/artifact={}/with_er={}/{}/{} R{}.csv'.format(
+                    num_subs, str(rotation), artifact_name, extra_er_subs, buff_names, weapon_name, refine
                 )
+                cell_trace = hit_trace((atk, crate, cdmg), artifact_set, weapon(refine, rotation=rotation), buffs, rotation)
+                write_csv('traces', filename, cell_trace.table())
+
+        # Print the weapon's row of the chart to stdout.
+        print(_chart_line(chart_row, widths), flush=True)
+
+        if not write:
+            continue
+        if store:
+            store.put(weapon_rows, weapon_marginals)
+            continue
+
+        # Append the weapon to the chart, substat distribution and marginal substat value CSVs.
+        write_csv('charts', chart_filename, [chart_row], mode='a')
+        write_csv('substats', substats_filename, optimal_substats, mode='a')
+        write_csv('marginals', substats_filename, marginal_substats, mode='a')
 
-                # Save results.
-                optimal_substats.append([weapon_name, 'R{}'.format(refine), atk, crate, cdmg])
-                row.append(dmg)
-            weapon_chart.append(row)
-    
-        # weapon_chart[1:] = sorted(weapon_chart[1:], key=lambda row: row[1], reverse=True)
-        
-        # Print weapon chart to stdout.
-        artifact_name = str(artifact_set(rotation))
-        print('\nNum Subs: {}'.format(num_subs))
-        print('Rotation: {}'.format(str(rotation)))
-        print('Artifact: {}'.format(artifact_name))
-        print('With ER: {}'.format(extra_er_subs))
-        print('Buffs: [{}]'.format(", ".join(map(str, buffs))))
-        print(tabulate(weapon_chart, headers='firstrow'))
-
-        # Save weapon chart to CSV.
-        filename = 'num_subs={}/rotation={}/artifact={}/with_er={}/{}.csv'.format(
-            num_subs, str(rotation), artifact_name, extra_er_subs, "-".join(map(str, buffs))
-        )
-        write_csv('charts', filename, weapon_chart)
-        
-        # Save substat distribution to CSV.
-        filename = 'num_subs={}/artifact={}/with_er={}/{}.csv'.format(
-            num_subs, artifact_name, extra_er_subs, "-".join(map(str, buffs))
-        )
-        write_csv('substats', filename, optimal_substats)
+def stream_charts(
+    num_subs, artifact_set, buff_lists, weapons, rotation, extra_er_subs=False,
+    method='vectorized', workers=1, chunksize=1, cache: CellCache = None, refines=range(1, 6), positions=None,
+    with_marginals=False
+):
+    """
+    Yields the rows of solve_charts one weapon at a time, as a list with a row per
+    refine, as soon as every refine of the weapon is solved. Only the rows of one
+    weapon are held at a time. With with_marginals, rows are (row, marginals)
+    pairs, see solve_charts.
+    """
+    refines = list(refines)
+    rows = solve_charts(
+        num_subs, artifact_set, buff_lists, weapons, rotation, extra_er_subs, method, workers, chunksize,
+        cache, refines, positions, with_marginals
+    )
+    while True:
+        weapon_rows = list(itertools.islice(rows, len(refines)))
+        if not weapon_rows:
+            return
+        yield weapon_rows
+
+# Width of a damage column of a printed chart, enough for e.g. 1.23456e+06.
+_DMG_WIDTH = 11
+
+def _chart_line(row, widths):
+    """
+    Formats a row of a printed chart: names left aligned, damage right aligned, like tabulate.
+    """
+    cells = []
+    for value, width in zip(row, widths):
+        if isinstance(value, str):
+            cells.append(value.ljust(width) if not cells else value.rjust(width))
+        else:
+            cells.append('{:>{}g}'.format(value, width))
+    return '  '.join(cells).rstrip()
 
 if __name__ == '__main__':
     """
-    Configure your comparison parameters here.
-        num_subs: Number of artifact substats.
-        rotation: Rotation.
-        artifact_set: Artifact set.
-        buff_combos: Buff combinations. Each combo corresponds to one output chart.
-        weapons: List of weapons to compare for each chart.
-        extra_er_subs: Set to True if you want ER weapons to get 5 extra subs.
-    """
-
-    num_subs = 25
-
-    rotation = EE12HP()
-
-    buff_combos = [
-        # [Solo],
-        # [TTDS],
-        # [Bennett, Noblesse],
-        # [TTDS, Bennett, Noblesse],
-        # [FaruzanC2],
-        # [FaruzanC6, TotM],
-        # [Bennett, Noblesse, FaruzanC6, TotM],
-        # [CraneXianyun, FaruzanC6, Noblesse, TotM, Bennett],
-        # [FurinaC0, FaruzanC6, Noblesse, TotM],
-        # [FurinaC050HP, FaruzanC6, Noblesse, TotM],
-        # [FurinaWithXianyun, TTDSXianyun, TTDS, FaruzanC6, Noblesse, TotM],
-        # [FurinaWithXianyun, CraneXianyun, FaruzanC6, Noblesse, TotM],
-        [FaruzanC6, CraneXianyun, Zhongli, Noblesse, TotM]
-    ]
+    Generates the charts configured in config.toml. Run `python3 main.py --help`
+    for filters that compute only part of them.
+    """
+    args = config.argument_parser().parse_args()
+    selected = config.select(config.load(args.config), args)
+
+    cache = CellCache(selected['cache_dir']) if selected['cache_dir'] else None
+    store = ResultsStore(selected['results']) if selected['results'] else None
+    profiler = profiling.Profiler() if args.profile else nullcontext()
+
+    with profiler:
+        for rotation in selected['rotations']:
+            for num_subs in selected['num_subs']:
+                for artifact_set in selected['artifact_sets']:
+                    main(
+                        num_subs,
+                        artifact_set,
+                        selected['buff_combos'],
+                        selected['weapons'],
+                        rotation,
+                        selected['extra_er_subs'],
+                        method=selected['method'],
+                        workers=selected['workers'],
+                        chunksize=selected['chunksize'],
+                        cache=cache,
+                        refines=selected['refines'],
+                        write=selected['write'],
+                        store=store,
+                        trace=args.trace,
+                        positions=selected['positions']
+                    )
 
-    for artifact_set in [AnemoAnemo, AtkAnemo, AtkAtk, Vermillion, LongNightOath, Hunter]:
-        weapons = [
-            partial(PJWS),
-            partial(Homa, below50=True),
-            partial(Homa),
-            partial(FracturedHalo),
-            partial(LumidouceElegy),
-            partial(Vortex, shielded=True, stacked=True),
-            partial(Vortex, shielded=True, stacked=False),
-            partial(CalamityQueller, stacked=True),
-            partial(CalamityQueller, stacked=False),
-            partial(Vortex, shielded=False, stacked=True),
-            partial(Vortex, shielded=False, stacked=False),
-            partial(StaffOfTheScarletSands),
-            partial(SkywardSpine),
-            partial(EngulfingLightning),
-            partial(SacrificersStaff),
-            partial(Lithic, stacks=4),
-            partial(Lithic, stacks=3),
-            partial(Lithic, stacks=2),
-            partial(Lithic, stacks=1),
-            partial(Deathmatch, num_opponents=1),
-            partial(Deathmatch, num_opponents=2),
-            partial(Blackcliff, stacks=3),
-            partial(Blackcliff, stacks=2),
-            partial(Blackcliff, stacks=1),
-            partial(Blackcliff, stacks=0),
-            partial(MissiveWindspear, passive_active=True),
-            partial(MissiveWindspear, passive_active=False),
-            partial(WavebreakersFin),
-            partial(FavoniusLance),
-            partial(PrototypeStarglitter),
-            partial(WhiteTassel)
-        ]
-
-        extra_er_subs = False # Change to True if you want to give ER weapons +5 subs
-
-        main(num_subs, artifact_set, buff_combos, weapons, rotation, extra_er_subs)
+    if args.profile:
+        profiler.print_summary()
+        profiler.write_json(args.profile)
@@ -0,0 +1,213 @@
+from main import *
+
+import config
+
+import argparse
+import math
+import numpy as np
+from tabulate import tabulate
+
+# Substat weights of 5 star artifacts. DEF is rolled, but Xiao has no use for it.
+SUBSTAT_WEIGHTS = {
+    'flat_hp': 6, 'flat_atk': 6, 'flat_def': 6, 'hp': 4, 'atk': 4, 'def': 4,
+    'er': 4, 'em': 4, 'crate': 3, 'cdmg': 3
+}
+
+# Each roll adds 70%, 80%, 90% or 100% of the max roll value, equally likely.
+ROLL_TIERS = (0.7, 0.8, 0.9, 1.0)
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+class ArtifactRoller:
+    """
+    Samples the substats of random +20 5 star artifact sets.
+
+    Each piece draws 4 distinct substat lines by weight, never its main stat, and
+    starts with 3 or 4 of them. Each of its 5 upgrades adds the missing 4th line or
+    rolls a random existing line, and every roll picks a random roll tier.
+
+    Attributes:
+        main_stats: Main stat of each piece, see Artifact.main_stats.
+        four_line_chance: Chance of a piece starting with 4 substat lines.
+        rng: NumPy random generator. Seeding it makes samples reproducible.
+    """
+
+    def __init__(self, main_stats=Artifact.main_stats, four_line_chance=0.2, seed=None):
+        self.main_stats = main_stats
+        self.four_line_chance = four_line_chance
+        self.rng = np.random.default_rng(seed)
+
+        # Max roll value of every substat Stats models.
+        unit = Stats()
+        unit.add_artifact_subs(flat_atk=1, atk=1, flat_hp=1, hp=1, em=1, er=1, crate=1, cdmg=1)
+        self._max_rolls = {name: getattr(unit, name) for name in SUBSTAT_WEIGHTS if name in Stats.__slots__}
+
+    ##################
+    # Public Methods #
+    ##################
+
+    def sample(self, size: int):
+        """
+        Returns the substats of size random artifact sets as a Stats of arrays.
+        """
+        names = list(SUBSTAT_WEIGHTS)
+        weights = np.array([SUBSTAT_WEIGHTS[name] for name in names], dtype=float)
+        rolls = {name: np.zeros(size) for name in self._max_rolls}
+
+        for main_stat in self.main_stats:
+            # Weighted draws without replacement, via the Gumbel top-k trick.
+            log_weights = np.where([name == main_stat for name in names], -np.inf, np.log(weights))
+            keys = log_weights + self.rng.gumbel(size=(size, len(names)))
+            lines = np.argsort(-keys, axis=1)[:, :4]
+
+            # Every line gets one roll. With only 3 starting lines, the first
+            # upgrade adds the 4th line instead of rolling an existing one.
+            upgrades = self.rng.integers(0, 4, size=(size, 5))
+            four_lines = self.rng.random(size) < self.four_line_chance
+            slot_lines = np.concatenate([np.broadcast_to(np.arange(4), (size, 4)), upgrades], axis=1)
+            slot_rolls = self.rng.choice(ROLL_TIERS, size=(size, 9))
+            slot_rolls[:, 4] *= four_lines
+
+            for line in range(4):
+                line_rolls = (slot_rolls * (slot_lines == line)).sum(axis=1)
+                for name in rolls:
+                    rolls[name] += np.where(lines[:, line] == names.index(name), line_rolls, 0.0)
+
+        return Stats(**{name: rolls[name] * self._max_rolls[name] for name in rolls})
+
+
+class StreamingPercentiles:
+    """
+    Approximate percentiles of a stream of positive values, in constant memory.
+
+    Values are counted into log spaced bins spanning a factor of span either side
+    of the first batch's median, so percentiles are within relative_error of the
+    exact ones. Values outside the bins are counted in the edge bins. Count,
+    mean, min and max are exact.
+    """
+
+    def __init__(self, relative_error=1e-4, span=4.0):
+        self.relative_error = relative_error
+        self.span = span
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._width = 2 * math.log1p(relative_error)
+        self._counts = np.zeros(int(math.ceil(2 * math.log(span) / self._width)), dtype=np.int64)
+        self._low = None
+
+    ##################
+    # Public Methods #
+    ##################
+
+    def update(self, values):
+        """
+        Adds a batch of values.
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        if not len(values):
+            return
+        if self._low is None:
+            self._low = math.log(np.median(values)) - math.log(self.span)
+
+        bins = np.floor((np.log(values) - self._low) / self._width).astype(np.int64)
+        self._counts += np.bincount(np.clip(bins, 0, len(self._counts) - 1), minlength=len(self._counts))
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def mean(self):
+        """Returns the exact mean."""
+        return self.total / self.count
+
+    def percentile(self, q: float):
+        """
+        Returns the q-th percentile, for q between 0 and 100.
+        """
+        if not self.count:
+            raise ValueError('No values to take percentiles of')
+        rank = q / 100 * self.count
+        index = int(np.searchsorted(np.cumsum(self._counts), max(rank, 1)))
+        value = math.exp(self._low + (index + 0.5) * self._width)
+        return min(max(value, self.min), self.max)
+
+
+def simulate(
+    artifact_set, weapon: Weapon, buffs, rotation: Rotation, num_samples=1000000, batch_size=65536, seed=0
+):
+    """
+    Returns a StreamingPercentiles of Xiao's rotation damage over num_samples
+    random artifact sets, evaluated batch_size at a time as NumPy arrays.
+
+    The same seed and batch_size draw the same artifacts, so cells with the same
+    seed are compared on the same artifacts.
+    """
+    roller = ArtifactRoller(artifact_set.main_stats, seed=seed)
+    xiao = Xiao(weapon, artifact_set(rotation=rotation), buffs, rotation)
+    results = StreamingPercentiles()
+    for start in range(0, num_samples, batch_size):
+        xiao.reset(roller.sample(min(batch_size, num_samples - start)))
+        results.update(xiao.run())
+    return results
+
+def main(
+    artifact_set, buff_combos, weapons, rotation, refines=range(1, 6), num_samples=1000000,
+    batch_size=65536, seed=0, percentiles=PERCENTILES, write=True
+):
+    """
+    Generate Monte Carlo charts of damage percentiles per weapon and refine, one
+    per buff combo. Charts are saved as CSVs under monte_carlo/ if write is True.
+    """
+    for buff_types in buff_combos:
+        buffs = [buff_type(rotation=rotation) for buff_type in buff_types]
+        chart = [['Weapon', 'Refine', 'Mean'] + ['P{}'.format(q) for q in percentiles]]
+        for weapon in weapons:
+            for refine in refines:
+                results = simulate(
+                    artifact_set, weapon(refine, rotation=rotation), buffs, rotation, num_samples, batch_size, seed
+                )
+                chart.append(
+                    [str(weapon(refine=1)), 'R{}'.format(refine), results.mean()] +
+                    [results.percentile(q) for q in percentiles]
+                )
+
+        # Print chart to stdout.
+        artifact_name = str(artifact_set(rotation))
+        print('\nSamples: {}'.format(num_samples))
+        print('Rotation: {}'.format(str(rotation)))
+        print('Artifact: {}'.format(artifact_name))
+        print('Buffs: [{}]'.format(", ".join(map(str, buffs))))
+        print(tabulate(chart, headers='firstrow'))
+
+        if write:
+            filename = 'rotation={}/artifact={}/{}.csv'.format(str(rotation), artifact_name, "-".join(map(str, buffs)))
+            write_csv('monte_carlo', filename, chart)
+
+if __name__ == '__main__':
+    """
+    Generates Monte Carlo charts for the charts configured in config.toml. Takes
+    the same filters as main.py.
+    """
+    parser = config.argument_parser()
+    parser.description = 'Generate Xiao weapon charts over randomly rolled artifacts.'
+    parser.add_argument('--samples', type=int, default=1000000, help='artifact sets sampled per cell')
+    parser.add_argument('--batch-size', type=int, default=65536, help='artifact sets evaluated at a time')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+    selected = config.select(config.load(args.config), args)
+
+    for rotation in selected['rotations']:
+        for artifact_set in selected['artifact_sets']:
+            main(
+                artifact_set,
+                selected['buff_combos'],
+                selected['weapons'],
+                rotation,
+                refines=selected['refines'],
+                num_samples=args.samples,
+                batch_size=args.batch_size,
+                seed=args.seed,
+                write=selected['write']
+            )
@@ -0,0 +1,172 @@
+from artifacts import Artifact
+from buffs import Buff
+from stats import Stats
+from weapons import Weapon
+from xiao import Xiao
+
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+import json
+from tabulate import tabulate
+import time
+
+# The Profiler currently collecting, if any.
+_active = None
+
+class Profiler:
+    """
+    Counts and times calls to the damage engine's hot paths: Xiao._dmgcalc,
+    Xiao._get_dynamic_stats, every Weapon and Artifact dynamic_stats, every
+    Buff.buff and Stats allocations, plus the time spent on each chart cell.
+
+    Instrumentation is patched into the classes on entering the context and
+    removed on exit, so it costs nothing when not profiling. Times are inclusive
+    of nested instrumented calls.
+
+    Usage:
+        with Profiler() as profiler:
+            main(...)
+        profiler.print_summary()
+        profiler.write_json('profile.json')
+    """
+
+    def __init__(self):
+        self.calls = defaultdict(int)
+        self.times = defaultdict(float)
+        self.cells = []
+        self.wall_time = 0.0
+        self._patches = []
+        self._start = None
+
+    def __enter__(self):
+        global _active
+        if _active is not None:
+            raise RuntimeError('Another Profiler is already active')
+
+        self._patch(Xiao, '_dmgcalc')
+        self._patch(Xiao, '_get_dynamic_stats')
+        self._patch(Stats, '__init__')
+        for cls in _subclasses(Weapon) + _subclasses(Artifact):
+            self._patch(cls, 'dynamic_stats')
+        for cls in _subclasses(Buff):
+            self._patch(cls, 'buff')
+
+        _active = self
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active
+        self.wall_time += time.perf_counter() - self._start
+        _active = None
+
+        # Restore in reverse, in case a method was patched twice.
+        for cls, name, original in reversed(self._patches):
+            setattr(cls, name, original)
+        self._patches = []
+        return False
+
+    ##################
+    # Public Methods #
+    ##################
+
+    def report(self):
+        """
+        Returns the collected counters as a JSON serializable dict.
+        """
+        functions = [
+            {
+                'name': name,
+                'calls': self.calls[name],
+                'total_s': self.times[name],
+                'mean_s': self.times[name] / self.calls[name]
+            }
+            for name in sorted(self.calls, key=lambda name: self.times[name], reverse=True)
+        ]
+        cells = [{'cell': label, 'seconds': seconds} for label, seconds in self.cells]
+        return {'wall_s': self.wall_time, 'functions': functions, 'cells': cells}
+
+    def print_summary(self, num_cells: int = 10):
+        """
+        Prints the per function counters and the num_cells slowest chart cells.
+        """
+        report = self.report()
+        table = [['Function', 'Calls', 'Total (ms)', 'Mean (us)']]
+        for function in report['functions']:
+            table.append([function['name'], function['calls'], function['total_s'] * 1e3, function['mean_s'] * 1e6])
+        print('\nWall time: {:.3f}s'.format(report['wall_s']))
+        print(tabulate(table, headers='firstrow', floatfmt='.2f'))
+
+        if report['cells']:
+            slowest = sorted(report['cells'], key=lambda cell: cell['seconds'], reverse=True)[:num_cells]
+            table = [['Cell', 'Time (ms)']] + [[cell['cell'], cell['seconds'] * 1e3] for cell in slowest]
+            print('\nSlowest {} of {} cells:'.format(len(slowest), len(report['cells'])))
+            print(tabulate(table, headers='firstrow', floatfmt='.2f'))
+
+    def write_json(self, filename: str):
+        """
+        Writes the report to filename as JSON.
+        """
+        with open(filename, 'w', encoding='UTF8') as outfile:
+            json.dump(self.report(), outfile, indent=2)
+
+    ###################
+    # Private Methods #
+    ###################
+
+    def _patch(self, cls, name):
+        """
+        Replaces cls.name with a wrapper that counts and times it. Only patches
+        classes that define name themselves; calls are keyed by the runtime class
+        so inherited methods are still attributed to the subclass.
+        """
+        if name not in cls.__dict__:
+            return
+        original = cls.__dict__[name]
+        calls, times = self.calls, self.times
+
+        def wrapper(obj, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(obj, *args, **kwargs)
+            finally:
+                key = '{}.{}'.format(type(obj).__name__, name)
+                calls[key] += 1
+                times[key] += time.perf_counter() - start
+
+        setattr(cls, name, wrapper)
+        self._patches.append((cls, name, original))
+
+    @contextmanager
+    def _time_cell(self, label):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.cells.append((label, time.perf_counter() - start))
+
+
+def is_active():
+    """
+    Returns true while a Profiler is collecting.
+    """
+    return _active is not None
+
+def cell(describe):
+    """
+    Returns a context manager that times one chart cell while profiling, and does
+    nothing otherwise. describe is only called when profiling and returns the
+    cell's label.
+    """
+    if _active is None:
+        return nullcontext()
+    return _active._time_cell(describe())
+
+def _subclasses(cls):
+    """
+    Returns cls and all of its subclasses, without duplicates.
+    """
+    classes = [cls]
+    for subclass in cls.__subclasses__():
+        classes.extend(_subclasses(subclass))
+    return list(dict.fromkeys(classes))
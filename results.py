@@ -0,0 +1,270 @@
+import argparse
+import os
+import sqlite3
+import time
+from tabulate import tabulate
+
+# Columns of a chart cell, in the order ResultsStore.put takes them.
+COLUMNS = (
+    'num_subs', 'rotation', 'artifact', 'with_er', 'buffs', 'weapon', 'refine', 'position',
+    'atk', 'crate', 'cdmg', 'dmg'
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cells (
+    num_subs INTEGER NOT NULL,
+    rotation TEXT NOT NULL,
+    artifact TEXT NOT NULL,
+    with_er INTEGER NOT NULL,
+    buffs TEXT NOT NULL,
+    buff_key TEXT NOT NULL,
+    weapon TEXT NOT NULL,
+    refine INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    atk INTEGER NOT NULL,
+    crate INTEGER NOT NULL,
+    cdmg INTEGER NOT NULL,
+    dmg REAL NOT NULL,
+    PRIMARY KEY (num_subs, rotation, artifact, with_er, buff_key, weapon, refine)
+);
+CREATE INDEX IF NOT EXISTS cells_weapon ON cells (weapon, refine);
+CREATE INDEX IF NOT EXISTS cells_artifact ON cells (artifact);
+CREATE INDEX IF NOT EXISTS cells_rotation ON cells (rotation);
+CREATE INDEX IF NOT EXISTS cells_buffs ON cells (buff_key);
+CREATE INDEX IF NOT EXISTS cells_num_subs ON cells (num_subs);
+
+-- Damage per extra sub at each cell's optimum, see main.marginals.
+CREATE TABLE IF NOT EXISTS marginals (
+    num_subs INTEGER NOT NULL,
+    rotation TEXT NOT NULL,
+    artifact TEXT NOT NULL,
+    with_er INTEGER NOT NULL,
+    buff_key TEXT NOT NULL,
+    weapon TEXT NOT NULL,
+    refine INTEGER NOT NULL,
+    atk REAL NOT NULL,
+    crate REAL NOT NULL,
+    cdmg REAL NOT NULL,
+    hp REAL NOT NULL,
+    em REAL NOT NULL,
+    er REAL NOT NULL,
+    PRIMARY KEY (num_subs, rotation, artifact, with_er, buff_key, weapon, refine)
+);
+
+-- One row per chart file of the CSV tree, see ResultsStore.export.
+CREATE VIEW IF NOT EXISTS charts AS
+SELECT DISTINCT num_subs, rotation, artifact, with_er, buffs, buff_key FROM cells;
+"""
+
+class ResultsStore:
+    """
+    SQLite database of chart cell results, one row per (num_subs, rotation,
+    artifact, with_er, buffs, weapon, refine) cell with its damage and optimal
+    substat split. Every filterable column is indexed, so questions across charts,
+    e.g. how one weapon ranks under every buff combo, are a single query.
+
+    The charts/, substats/ and marginals/ CSV trees main.py used to write are
+    views of it, see export.
+
+    Attributes:
+        filename: Path of the database file.
+        connection: Open sqlite3 connection.
+    """
+
+    def __init__(self, filename: str = 'results.sqlite'):
+        self.filename = filename
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Callers sharing a store across threads serialize access themselves, see server.py.
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        # WAL lets readers query while a sweep is writing.
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    ##################
+    # Public Methods #
+    ##################
+
+    def put(self, rows, marginals=None):
+        """
+        Inserts or replaces cells in one transaction. Each row holds the values of
+        COLUMNS, with buffs given as a list of buff names in chart order. If given,
+        marginals holds each row's damage per extra sub of main.MARGINAL_SUBS.
+        """
+        records = []
+        for row in rows:
+            cell = dict(zip(COLUMNS, row))
+            buffs = list(cell['buffs'])
+            records.append((
+                int(cell['num_subs']), str(cell['rotation']), str(cell['artifact']), int(bool(cell['with_er'])),
+                '-'.join(buffs), buff_key(buffs), str(cell['weapon']), int(cell['refine']),
+                int(cell['position']), int(cell['atk']), int(cell['crate']), int(cell['cdmg']), float(cell['dmg'])
+            ))
+
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO cells VALUES ({})'.format(', '.join('?' * (len(COLUMNS) + 1))), records
+            )
+            if marginals is not None:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO marginals VALUES ({})'.format(', '.join('?' * 13)),
+                    [record[:4] + record[5:8] + tuple(map(float, values)) for record, values in zip(records, marginals)]
+                )
+        return len(records)
+
+    def cells(self, order_by='dmg DESC', **filters):
+        """
+        Returns the cells matching every filter, e.g. cells(weapon='Homa', refine=1).
+        buffs matches a combo in any order, given as a list of buff names or a
+        '-' separated string.
+        """
+        clauses, params = [], []
+        for column, value in filters.items():
+            if column == 'buffs':
+                column = 'buff_key'
+                value = buff_key(value.split('-') if isinstance(value, str) else value)
+            elif column not in COLUMNS:
+                raise ValueError('Unknown column: {}'.format(column))
+            clauses.append('{} = ?'.format(column))
+            params.append(int(value) if isinstance(value, bool) else value)
+
+        query = 'SELECT * FROM cells'
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        if order_by:
+            query += ' ORDER BY ' + order_by
+        return self.connection.execute(query, params).fetchall()
+
+    def export(self, charts_dir: str = 'charts', substats_dir: str = 'substats', marginals_dir: str = 'marginals'):
+        """
+        Writes every chart as the weapon chart, substat distribution and marginal
+        substat value CSVs main.py writes without a store. Charts without stored
+        marginals get no marginals CSV. Returns the number of charts written.
+        """
+        # Avoid a circular import, main imports this module.
+        from main import write_csv
+
+        charts = self.connection.execute('SELECT * FROM charts ORDER BY num_subs, rotation, artifact, with_er, buffs')
+        num_charts = 0
+        for chart in charts.fetchall():
+            weapon_chart, optimal_substats = self._chart_tables(chart)
+            with_er = bool(chart['with_er'])
+            filename = 'num_subs={}/rotation={}/artifact={}/with_er={}/{}.csv'.format(
+                chart['num_subs'], chart['rotation'], chart['artifact'], with_er, chart['buffs']
+            )
+            write_csv(charts_dir, filename, weapon_chart)
+            filename = 'num_subs={}/artifact={}/with_er={}/{}.csv'.format(
+                chart['num_subs'], chart['artifact'], with_er, chart['buffs']
+            )
+            write_csv(substats_dir, filename, optimal_substats)
+            marginal_substats = self._marginals_table(chart)
+            if len(marginal_substats) > 1:
+                write_csv(marginals_dir, filename, marginal_substats)
+            num_charts += 1
+        return num_charts
+
+    def info(self):
+        """
+        Returns the number of cells and charts stored.
+        """
+        num_cells = self.connection.execute('SELECT COUNT(*) FROM cells').fetchone()[0]
+        num_charts = self.connection.execute('SELECT COUNT(*) FROM charts').fetchone()[0]
+        return num_cells, num_charts
+
+    def close(self):
+        self.connection.close()
+
+    ###################
+    # Private Methods #
+    ###################
+
+    def _chart_tables(self, chart):
+        """
+        Returns the weapon chart and substat distribution tables of a chart, laid
+        out like main.main's.
+        """
+        rows = self.connection.execute(
+            'SELECT weapon, refine, atk, crate, cdmg, dmg FROM cells '
+            'WHERE num_subs = ? AND rotation = ? AND artifact = ? AND with_er = ? AND buff_key = ? '
+            'ORDER BY position, weapon, refine',
+            (chart['num_subs'], chart['rotation'], chart['artifact'], chart['with_er'], chart['buff_key'])
+        ).fetchall()
+
+        refines = sorted({row['refine'] for row in rows})
+        weapon_chart = [['Weapon'] + ['R{}'.format(refine) for refine in refines]]
+        optimal_substats = [['weapon', 'refine', 'atk', 'crate', 'cdmg']]
+        for row in rows:
+            if weapon_chart[-1][0] != row['weapon']:
+                weapon_chart.append([row['weapon']] + [''] * len(refines))
+            weapon_chart[-1][1 + refines.index(row['refine'])] = row['dmg']
+            optimal_substats.append(
+                [row['weapon'], 'R{}'.format(row['refine']), row['atk'], row['crate'], row['cdmg']]
+            )
+        return weapon_chart, optimal_substats
+
+    def _marginals_table(self, chart):
+        """
+        Returns the marginal substat value table of a chart, laid out like main.main's.
+        """
+        rows = self.connection.execute(
+            'SELECT marginals.* FROM marginals JOIN cells USING '
+            '(num_subs, rotation, artifact, with_er, buff_key, weapon, refine) '
+            'WHERE num_subs = ? AND rotation = ? AND artifact = ? AND with_er = ? AND buff_key = ? '
+            'ORDER BY position, weapon, refine',
+            (chart['num_subs'], chart['rotation'], chart['artifact'], chart['with_er'], chart['buff_key'])
+        ).fetchall()
+        table = [['weapon', 'refine', 'atk', 'crate', 'cdmg', 'hp', 'em', 'er']]
+        for row in rows:
+            table.append([row['weapon'], 'R{}'.format(row['refine'])] + [row[name] for name in table[0][2:]])
+        return table
+
+
+def buff_key(buffs):
+    """
+    Returns the order independent key of a buff combo, its sorted buff names.
+    """
+    return '-'.join(sorted(map(str, buffs)))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query and export the chart results database.')
+    parser.add_argument(
+        'command', choices=['info', 'export', 'query'],
+        help='info: show database size, export: write the charts/, substats/ and marginals/ CSVs, '
+        'query: print cells matching the filters, best first'
+    )
+    parser.add_argument('--db', default='results.sqlite', help='database file (default: results.sqlite)')
+    parser.add_argument('--weapon', help='weapon chart name, e.g. "Homa (50%%)"')
+    parser.add_argument('--refine', type=int, help='weapon refinement, 1-5')
+    parser.add_argument('--artifact', help='artifact set, e.g. AtkAtk')
+    parser.add_argument('--buffs', help='buff combo in any order, e.g. FaruzanC6-CraneXianyun-Zhongli')
+    parser.add_argument('--rotation', help='rotation, e.g. EE12HP')
+    parser.add_argument('--num-subs', type=int, help='number of artifact substats')
+    args = parser.parse_args()
+
+    with ResultsStore(args.db) as store:
+        if args.command == 'info':
+            num_cells, num_charts = store.info()
+            print('{}: {} cells in {} charts'.format(args.db, num_cells, num_charts))
+        elif args.command == 'export':
+            print('Exported {} charts from {}'.format(store.export(), args.db))
+        else:
+            filters = {
+                name: value for name, value in vars(args).items()
+                if name in ('weapon', 'refine', 'artifact', 'buffs', 'rotation', 'num_subs') and value is not None
+            }
+            start = time.perf_counter()
+            rows = store.cells(**filters)
+            elapsed = time.perf_counter() - start
+            print(tabulate(
+                [[row[column] for column in COLUMNS if column != 'position'] for row in rows],
+                headers=[column for column in COLUMNS if column != 'position']
+            ))
+            print('{} cells in {:.1f} ms'.format(len(rows), elapsed * 1000))
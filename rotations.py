@@ -2,8 +2,15 @@ class Rotation:
     """
     Represents a Xiao rotation. These classes allow the user to define all dynamic buffs
     differently depending on the hit count for each rotation.
+
+    Attributes:
+        actions: Xiao's action sequence as (action, repeat) pairs. An action is one of
+            'skill', 'burst', 'n1', 'ca' and 'high_plunge', or a nested sequence of
+            (action, repeat) pairs that is repeated as a group.
     """
 
+    actions = ()
+
     def __str__(self):
         return self.__class__.__name__
     
@@ -65,6 +72,8 @@ class EE12HP(Rotation):
     """
     EE Q 12HP.
     """
+
+    actions = (('skill', 2), ('burst', 1), ('high_plunge', 12))
     
     def a1_bonus_dmg(self, num_hits):
         num_plunge = num_hits - 1
@@ -149,6 +158,8 @@ class EE8N1CJP(Rotation):
     """
     EE Q 8N1CJHP.
     """
+
+    actions = (('skill', 2), ('burst', 1), ((('n1', 1), ('ca', 1), ('high_plunge', 1)), 8))
     
     def a1_bonus_dmg(self, num_hits):
         if num_hits <= 8:
@@ -220,5 +231,21 @@ class EE8N1CJP(Rotation):
             return 2
         return 0
 
-class Custom(Rotation):
-    pass
+class Custom(EE12HP):
+    """
+    Rotation with a custom action sequence, e.g.
+    Custom([('skill', 2), ('burst', 1), ('high_plunge', 10)]).
+    Dynamic buffs use the EE12HP hit counts.
+    """
+
+    def __init__(self, actions=EE12HP.actions):
+        self.actions = _freeze(actions)
+
+
+def _freeze(actions):
+    """
+    Converts an action sequence given as lists into tuples, so it can be compiled once.
+    """
+    if isinstance(actions, (list, tuple)):
+        return tuple(_freeze(item) for item in actions)
+    return actions
@@ -0,0 +1,303 @@
+from cache import CellCache
+import config
+from main import solve_charts
+from results import ResultsStore
+
+import argparse
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import sys
+import threading
+import traceback
+from urllib.parse import parse_qs, urlsplit
+
+class NotFoundError(LookupError):
+    """
+    Raised for requests to an unknown endpoint, answered with 404. Other lookup
+    errors, e.g. an IndexError from a buff table too short for the rotation, are bugs.
+    """
+
+
+class LRUCache:
+    """
+    Thread safe in-memory cache of the most recently used query responses.
+
+    Attributes:
+        max_entries: Maximum number of responses to keep. Least recently used ones
+            are evicted first.
+        hits: Number of lookups served from the cache.
+        misses: Number of lookups that were not.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    ##################
+    # Public Methods #
+    ##################
+
+    def get(self, key):
+        """
+        Returns the cached value for key, or None on a miss.
+        """
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class QueryServer(ThreadingHTTPServer):
+    """
+    HTTP server answering chart queries as JSON from a ResultsStore. Each request
+    is handled on its own thread. Responses are kept in an LRU cache, and chart
+    cells missing from the store are computed and saved on demand. The store is
+    not locked while cells are computed, so other requests are answered meanwhile.
+    Requests for the same chart wait for each other, so it is only computed once.
+
+    Endpoints:
+        GET /rank: The weapons of one chart, best first. Takes buffs (required),
+            artifact, rotation, num_subs, with_er, refine and limit. Every chart
+            setting but buffs defaults to the config's first entry, and refine to
+            every configured refine.
+        GET /cells: Stored cells matching the filters weapon, refine, artifact,
+            rotation, buffs, num_subs and with_er, best first. Never computes.
+        GET /stats: Cache hit and miss counts.
+
+    Attributes:
+        store: ResultsStore queried and filled in.
+        settings: Loaded chart config (see config.load), which gives the weapons and
+            defaults of computed charts.
+        queries: LRUCache of encoded responses.
+        cache: CellCache used when computing cells, if any.
+    """
+
+    def __init__(self, address, store: ResultsStore, settings: dict, max_entries: int = 1024):
+        super().__init__(address, QueryHandler)
+        self.store = store
+        self.settings = settings
+        self.queries = LRUCache(max_entries)
+        self.cache = CellCache(settings['cache']) if settings.get('cache') else None
+
+        # The store's connection is shared by every request thread.
+        self._lock = threading.Lock()
+        # One lock per chart being computed, see _chart_lock.
+        self._chart_locks = {}
+        # Bumped under _lock on every put, and part of every cached query's key.
+        self._version = 0
+
+    ##################
+    # Public Methods #
+    ##################
+
+    def query(self, path: str, params: dict):
+        """
+        Returns the encoded JSON response of a query, from the LRU cache if possible.
+
+        Responses are cached under the store version read before the query runs,
+        so a response that raced a put is cached under the old version and never
+        served again.
+        """
+        with self._lock:
+            version = self._version
+        key = (version, path, tuple(sorted(params.items())))
+        response = self.queries.get(key)
+        if response is None:
+            if path == '/rank':
+                result = self._rank(**params)
+            elif path == '/cells':
+                result = self._cells(**params)
+            elif path == '/stats':
+                # Never cached, counts change on every request.
+                return json.dumps({'hits': self.queries.hits, 'misses': self.queries.misses}).encode('UTF8')
+            else:
+                raise NotFoundError('Unknown endpoint: {}'.format(path))
+            response = json.dumps(result).encode('UTF8')
+            self.queries.put(key, response)
+        return response
+
+    ###################
+    # Private Methods #
+    ###################
+
+    def _rank(self, buffs=None, artifact=None, rotation=None, num_subs=None, with_er=None, refine=None, limit=None):
+        """
+        Ranks the weapons of a chart, computing any configured cells it is missing.
+        Every parameter is parsed before anything is computed.
+        """
+        if not buffs:
+            raise ValueError('Missing buffs, e.g. buffs=FaruzanC6-CraneXianyun-Zhongli')
+
+        # Resolve names as configs do, so unknown ones are rejected.
+        rotation = config.rotation(rotation or self.settings['rotations'][0])
+        artifact_set = config.artifact_set(artifact or self.settings['artifact_sets'][0])
+        chart = {
+            'num_subs': int(num_subs) if num_subs else self.settings['num_subs'][0],
+            'rotation': str(rotation),
+            'artifact': str(artifact_set(rotation)),
+            'with_er': _boolean(with_er) if with_er else self.settings.get('extra_er_subs', False),
+            'buffs': [str(config.buff(name)(rotation=rotation)) for name in buffs.replace(',', '-').split('-') if name],
+        }
+        refines = [int(refine)] if refine else self.settings.get('refines', [1, 2, 3, 4, 5])
+        limit = int(limit) if limit else None
+        if chart['num_subs'] < 0:
+            raise ValueError('num_subs must be at least 0, got {}'.format(chart['num_subs']))
+        if not all(1 <= refine <= 5 for refine in refines):
+            raise ValueError('refine must be 1-5, got {}'.format(refine))
+        if limit is not None and limit < 1:
+            raise ValueError('limit must be at least 1, got {}'.format(limit))
+
+        with self._chart_lock(chart):
+            computed = self._compute_missing(chart, artifact_set, rotation, refines)
+        with self._lock:
+            rows = [
+                row for row in self.store.cells(**chart) if row['refine'] in refines
+            ]
+
+        ranking = [
+            {column: row[column] for column in ('weapon', 'refine', 'dmg', 'atk', 'crate', 'cdmg')}
+            for row in rows
+        ]
+        if limit:
+            ranking = ranking[:limit]
+        chart['with_er'] = bool(chart['with_er'])
+        return {'chart': chart, 'computed': computed, 'ranking': ranking}
+
+    def _cells(self, **filters):
+        """
+        Looks up stored cells.
+        """
+        unknown = set(filters) - {'weapon', 'refine', 'artifact', 'rotation', 'buffs', 'num_subs', 'with_er'}
+        if unknown:
+            raise ValueError('Unknown filters: {}'.format(', '.join(sorted(unknown))))
+        for name in ('refine', 'num_subs'):
+            if name in filters:
+                filters[name] = int(filters[name])
+        if 'with_er' in filters:
+            filters['with_er'] = _boolean(filters['with_er'])
+        with self._lock:
+            rows = self.store.cells(**filters)
+        return [dict(row) for row in rows]
+
+    def _compute_missing(self, chart: dict, artifact_set, rotation, refines):
+        """
+        Computes and stores the configured weapons' cells of chart missing from the
+        store. Returns the number of cells computed.
+        """
+        buffs = [config.buff(name)(rotation=rotation) for name in chart['buffs']]
+
+        with self._lock:
+            stored = {(row['weapon'], row['refine']) for row in self.store.cells(order_by=None, **chart)}
+        weapons = [config.weapon(spec) for spec in self.settings['weapons']]
+        rows = []
+        for position, weapon in enumerate(weapons):
+            missing = [refine for refine in refines if (str(weapon(refine=1)), refine) not in stored]
+            if not missing:
+                continue
+            rows.extend(solve_charts(
+                chart['num_subs'], artifact_set, [buffs], [weapon], rotation, chart['with_er'],
+                method=self.settings.get('method', 'vectorized'), cache=self.cache, refines=missing,
+                positions=[position]
+            ))
+
+        if rows:
+            with self._lock:
+                self.store.put(rows)
+                self._version += 1
+            # Cached lookups may be missing the new cells. Free them, the version
+            # already keeps them from being served.
+            self.queries.clear()
+        return len(rows)
+
+    def _chart_lock(self, chart: dict):
+        """
+        Returns the lock held while computing a chart's missing cells.
+        """
+        key = json.dumps(chart, sort_keys=True)
+        with self._lock:
+            return self._chart_locks.setdefault(key, threading.Lock())
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of QueryServer.
+    """
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        try:
+            status, body = 200, self.server.query(url.path, params)
+        except NotFoundError as e:
+            status, body = 404, json.dumps({'error': str(e)}).encode('UTF8')
+        except (TypeError, ValueError) as e:
+            status, body = 400, json.dumps({'error': str(e)}).encode('UTF8')
+        except Exception as e:
+            # Still answer the client, and log the bug instead of dropping the connection.
+            print('Error handling {}:'.format(self.path), file=sys.stderr)
+            traceback.print_exc()
+            status, body = 500, json.dumps({'error': 'Internal error: {!r}'.format(e)}).encode('UTF8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep the console quiet, every request would be logged otherwise.
+        pass
+
+
+def _boolean(value: str):
+    """
+    Parses a query string boolean.
+    """
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError('Not a boolean: {}'.format(value))
+
+if __name__ == '__main__':
+    """
+    Serves chart queries on localhost, e.g.
+    curl 'localhost:8000/rank?buffs=FaruzanC6-CraneXianyun-Zhongli&artifact=AtkAtk&refine=1&limit=5'
+    """
+    parser = argparse.ArgumentParser(description='Serve Xiao weapon chart queries as JSON.')
+    parser.add_argument('--config', default='config.toml', help='JSON or TOML config file (default: config.toml)')
+    parser.add_argument('--db', help='results database (default: results in the config)')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on, 0 picks a free one (default: 8000)')
+    parser.add_argument('--max-entries', type=int, default=1024, help='queries kept in the LRU cache')
+    args = parser.parse_args()
+
+    settings = config.load(args.config)
+    with ResultsStore(args.db or settings.get('results') or 'results.sqlite') as store:
+        server = QueryServer((args.host, args.port), store, settings, args.max_entries)
+        print('Serving on http://{}:{}'.format(*server.server_address))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
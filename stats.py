@@ -3,6 +3,11 @@ class Stats:
     Represents Genshin stats for any character, weapon, artifact, etc.
     """
 
+    __slots__ = (
+        'base_atk', 'flat_atk', 'atk', 'base_hp', 'flat_hp', 'hp', 'em', 'er', 'crate',
+        'cdmg', 'anemo_dmg', 'bonus_dmg', 'res_shred', 'flat_dmg'
+    )
+
     #################
     # Magic Methods #
     #################
@@ -46,31 +51,62 @@ class Stats:
         )
 
     def __iadd__(self, other):
-        self.base_atk += other.base_atk
-        self.flat_atk += other.flat_atk
-        self.atk += other.atk
-        self.base_hp += other.base_hp
-        self.flat_hp += other.flat_hp
-        self.hp += other.hp
-        self.em += other.em
-        self.er += other.er
-        self.crate += other.crate
-        self.cdmg += other.cdmg
-        self.anemo_dmg += other.anemo_dmg
-        self.bonus_dmg += other.bonus_dmg
-        self.res_shred += other.res_shred
-        self.flat_dmg += other.flat_dmg
+        # Rebind instead of using +=, so array stats shared with another Stats
+        # are never modified in place.
+        self.base_atk = self.base_atk + other.base_atk
+        self.flat_atk = self.flat_atk + other.flat_atk
+        self.atk = self.atk + other.atk
+        self.base_hp = self.base_hp + other.base_hp
+        self.flat_hp = self.flat_hp + other.flat_hp
+        self.hp = self.hp + other.hp
+        self.em = self.em + other.em
+        self.er = self.er + other.er
+        self.crate = self.crate + other.crate
+        self.cdmg = self.cdmg + other.cdmg
+        self.anemo_dmg = self.anemo_dmg + other.anemo_dmg
+        self.bonus_dmg = self.bonus_dmg + other.bonus_dmg
+        self.res_shred = self.res_shred + other.res_shred
+        self.flat_dmg = self.flat_dmg + other.flat_dmg
         return self
     
     def __str__(self):
-        stats_dict = self.__dict__
-        for k,v in stats_dict.items():
-            stats_dict[k] = round(v, 3)
-        return str(stats_dict)
+        return str({k: round(getattr(self, k), 3) for k in self.__slots__})
 
     ##################
     # Public Methods #
     ##################
+
+    def assign(self, other):
+        """Overwrites every stat with other's, in place."""
+        self.base_atk = other.base_atk
+        self.flat_atk = other.flat_atk
+        self.atk = other.atk
+        self.base_hp = other.base_hp
+        self.flat_hp = other.flat_hp
+        self.hp = other.hp
+        self.em = other.em
+        self.er = other.er
+        self.crate = other.crate
+        self.cdmg = other.cdmg
+        self.anemo_dmg = other.anemo_dmg
+        self.bonus_dmg = other.bonus_dmg
+        self.res_shred = other.res_shred
+        self.flat_dmg = other.flat_dmg
+        return self
+
+    def reset(self):
+        """Sets every stat back to 0, in place."""
+        for name in self.__slots__:
+            setattr(self, name, 0.0)
+        return self
+
+    def copy(self):
+        """Returns a new Stats with the same values."""
+        return Stats().assign(self)
+
+    def maximum(self, other):
+        """Returns a new Stats with the elementwise maximum of both. Scalar stats only."""
+        return Stats(*(max(getattr(self, name), getattr(other, name)) for name in self.__slots__))
     
     def total_atk(self):
         """Returns the total ATK."""
@@ -102,6 +138,6 @@ class Stats:
         self.flat_hp += flat_hp * 253.94
         self.hp += hp * 0.04955
         self.em += em * 19.82
-        self.er += er * 5.505
+        self.er += er * 0.05505
         self.crate += crate * 0.0331
         self.cdmg += cdmg * 0.0662
@@ -0,0 +1,225 @@
+from main import *
+from xiao import compile_actions
+
+import config
+
+import argparse
+import itertools
+import sys
+import time
+from tabulate import tabulate
+
+# Buffs explored by default. Teams also include Solo, the empty team, see teams.
+DEFAULT_POOL = (
+    'Bennett', 'Noblesse', 'TotM', 'TTDS', 'GeoResonance', 'PyroResonance', 'Zhongli', 'FaruzanC2',
+    'FaruzanC6', 'FurinaC0', 'FurinaC050HP', 'FurinaWithXianyun', 'FurinaWithXianyunCrane', 'FurinaWithJean',
+    'FurinaWithBennett', 'TTDSXianyun', 'CraneXianyun'
+)
+
+# Buffs no team has more than one of: versions of the same character, and
+# elemental resonances, as Xiao leaves room for only one.
+DEFAULT_EXCLUSIVE = (
+    ('FaruzanC2', 'FaruzanC6'),
+    ('TTDSXianyun', 'CraneXianyun'),
+    ('FurinaC0', 'FurinaC050HP', 'FurinaWithXianyun', 'FurinaWithXianyunCrane', 'FurinaWithJean', 'FurinaWithBennett'),
+    ('GeoResonance', 'PyroResonance'),
+)
+
+class MemoizedBuff(Buff):
+    """
+    Wraps a buff so its stats at each hit are only computed once, then shared by
+    every team the buff is in.
+
+    Attributes:
+        inner: The wrapped buff.
+    """
+
+    def __init__(self, inner: Buff):
+        super().__init__(inner.rotation)
+        self.inner = inner
+        self.duration = inner.duration
+        self._hits = {}
+
+    def __str__(self):
+        return str(self.inner)
+
+    def buff(self, num_hits=0):
+        # Xiao only ever adds these into its own Stats, so sharing them is safe.
+        if num_hits not in self._hits:
+            self._hits[num_hits] = self.inner.buff(num_hits=num_hits)
+        return self._hits[num_hits]
+
+
+def teams(pool, max_size: int, exclusive=DEFAULT_EXCLUSIVE, min_size: int = 0):
+    """
+    Yields every team of min_size to max_size buffs from pool, as tuples in pool
+    order, that has at most one buff of each exclusive group. Buffs are given as
+    classes or names in both pool and exclusive. With min_size 0, the first team
+    is Solo, the empty tuple, as an unbuffed baseline.
+    """
+    pool = [_name(buff_type) for buff_type in pool]
+    groups = [{_name(buff_type) for buff_type in group} for group in exclusive]
+    for size in range(min_size, max_size + 1):
+        for team in itertools.combinations(pool, size):
+            if all(len(group.intersection(team)) <= 1 for group in groups):
+                yield team
+
+def supported(pool, rotation):
+    """
+    Returns the names of the buffs of pool that support rotation, i.e. give their
+    stats at the start of every attack of it without an error. The rest are skipped
+    with a warning, e.g. Furina buffs on rotations without Fanfare lists, or buffs
+    whose per hit tables are shorter than the rotation.
+    """
+    hits = attack_hits(rotation)
+    names = []
+    for name in map(_name, pool):
+        buff = config.buff(name)(rotation=rotation)
+        try:
+            for num_hits in hits:
+                buff.buff(num_hits=num_hits)
+        except Exception as e:
+            print('Skipping {}, which does not support {}: {!r}'.format(name, rotation, e), file=sys.stderr)
+            continue
+        names.append(name)
+    return names
+
+def attack_hits(rotation):
+    """
+    Returns the hit count at the start of each of the rotation's attacks, when
+    buffs are taken.
+    """
+    starts = []
+    num_hits = 0
+    for action, modifier, burst, hits in compile_actions(rotation.actions):
+        if modifier is not None:
+            starts.append(num_hits)
+            num_hits += hits
+    return starts
+
+def explore(
+    num_subs, artifact_set, weapon: Weapon, rotation, pool=DEFAULT_POOL, max_size: int = 4,
+    exclusive=DEFAULT_EXCLUSIVE, method='vectorized'
+):
+    """
+    Optimizes Xiao's substats for every legal team (see teams) and returns the
+    results best first, as (team, atk, crate, cdmg, dmg) with team a tuple of
+    buff names.
+
+    Each buff is constructed once and memoized (see MemoizedBuff), so its stats at
+    every hit of the rotation are computed once and shared by all its teams. Buffs
+    that do not support the rotation are left out, see supported.
+    """
+    pool = supported(pool, rotation)
+    memoized = {name: MemoizedBuff(config.buff(name)(rotation=rotation)) for name in map(_name, pool)}
+    results = []
+    for team in teams(pool, max_size, exclusive):
+        buffs = [memoized[name] for name in team]
+        results.append((team,) + tuple(optimize(num_subs, artifact_set, weapon, buffs, rotation, method=method)))
+    results.sort(key=lambda result: result[-1], reverse=True)
+    return results
+
+def main(
+    num_subs, artifact_set, weapon, refine, rotation, pool=DEFAULT_POOL, max_size: int = 4,
+    exclusive=DEFAULT_EXCLUSIVE, method='vectorized', top: int = 20, write=True
+):
+    """
+    Ranks every legal team for a weapon type and refine, printing the top teams.
+    The full ranking is saved as a CSV under teams/ if write is True.
+    """
+    start = time.perf_counter()
+    results = explore(num_subs, artifact_set, weapon(refine, rotation=rotation), rotation, pool, max_size, exclusive, method)
+    elapsed = time.perf_counter() - start
+
+    best_dmg = results[0][-1]
+    chart = [['Rank', 'Team', 'atk', 'crate', 'cdmg', 'DMG', '% of Best']]
+    for rank, (team, atk, crate, cdmg, dmg) in enumerate(results, 1):
+        chart.append([rank, team_name(team), atk, crate, cdmg, dmg, 100 * dmg / best_dmg])
+
+    # Print the top of the ranking to stdout.
+    weapon_name = '{} R{}'.format(weapon(refine=1), refine)
+    artifact_name = str(artifact_set(rotation))
+    print('\nNum Subs: {}'.format(num_subs))
+    print('Rotation: {}'.format(str(rotation)))
+    print('Artifact: {}'.format(artifact_name))
+    print('Weapon: {}'.format(weapon_name))
+    print('Teams: {} of up to {} buffs, in {:.1f}s'.format(len(results), max_size, elapsed))
+    print(tabulate(chart[:top + 1], headers='firstrow'))
+
+    if write:
+        filename = 'num_subs={}/rotation={}/artifact={}/max_size={}/{}.csv'.format(
+            num_subs, str(rotation), artifact_name, max_size, weapon_name
+        )
+        write_csv('teams', filename, chart)
+
+def team_name(team):
+    """
+    Returns a team's name as in charts, e.g. Bennett-FaruzanC6, or Solo for no buffs.
+    """
+    return "-".join(team) or Solo.__name__
+
+def _name(buff_type):
+    """
+    Returns the name of a buff class, or the name itself.
+    """
+    return buff_type if isinstance(buff_type, str) else buff_type.__name__
+
+if __name__ == '__main__':
+    """
+    Ranks every legal team made of a pool of buffs, for one weapon and refine at a time.
+    """
+    parser = argparse.ArgumentParser(description='Rank every legal team of buffs for Xiao.')
+    parser.add_argument('--config', default='config.toml', help='JSON or TOML config file (default: config.toml)')
+    parser.add_argument(
+        '--weapon', action='append',
+        help='weapon class or chart name, e.g. Homa or "Homa (50%%)". Default: the first configured weapon'
+    )
+    parser.add_argument('--refine', action='append', type=int, help='weapon refinement, 1-5. Default: 1')
+    parser.add_argument('--artifact', help='artifact set. Default: the first configured one')
+    parser.add_argument('--rotation', help='rotation. Default: the first configured one')
+    parser.add_argument('--num-subs', type=int, help='number of artifact substats. Default: the first configured one')
+    parser.add_argument('--pool', help='buffs to build teams from, e.g. Bennett-Noblesse-FaruzanC6. Default: every buff')
+    parser.add_argument('--size', type=int, default=4, help='maximum number of buffs per team (default: 4)')
+    parser.add_argument(
+        '--exclusive', action='append',
+        help='buffs no team may have more than one of, e.g. TTDS-TTDSXianyun. Added to the default groups'
+    )
+    parser.add_argument('--top', type=int, default=20, help='number of teams to print (default: 20)')
+    parser.add_argument(
+        '--write', action=argparse.BooleanOptionalAction, default=True, help='write the full ranking to teams/'
+    )
+    args = parser.parse_args()
+
+    settings = config.load(args.config)
+    weapon_list = [config.weapon(spec) for spec in settings['weapons']]
+    if args.weapon:
+        names = {name.lower() for name in args.weapon}
+        weapon_list = [
+            weapon_type for weapon_type in weapon_list
+            if weapon_type.func.__name__.lower() in names or str(weapon_type(refine=1)).lower() in names
+        ]
+        if not weapon_list:
+            raise ValueError('No configured weapon matches {}'.format(args.weapon))
+    else:
+        weapon_list = weapon_list[:1]
+
+    pool = args.pool.replace(',', '-').split('-') if args.pool else DEFAULT_POOL
+    exclusive = DEFAULT_EXCLUSIVE + tuple(tuple(group.replace(',', '-').split('-')) for group in args.exclusive or [])
+    for name in set(pool).union(*exclusive):
+        config.buff(name)
+
+    for weapon in weapon_list:
+        for refine in args.refine or [1]:
+            main(
+                args.num_subs or settings['num_subs'][0],
+                config.artifact_set(args.artifact or settings['artifact_sets'][0]),
+                weapon,
+                refine,
+                config.rotation(args.rotation or settings['rotations'][0]),
+                pool=pool,
+                max_size=args.size,
+                exclusive=exclusive,
+                method=settings.get('method', 'vectorized'),
+                top=args.top,
+                write=args.write
+            )
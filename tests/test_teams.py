@@ -0,0 +1,31 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from artifacts import AtkAtk
+from rotations import EE12HP, EE8N1CJP
+from teams import DEFAULT_POOL, explore, supported
+from weapons import PJWS
+
+
+def test_supported_skips_buffs_the_rotation_does_not_support():
+    names = supported(DEFAULT_POOL, EE8N1CJP())
+    assert 'FaruzanC6' in names
+    assert 'FurinaC0' not in names
+    assert 'TTDSXianyun' not in names
+    assert 'CraneXianyun' not in names
+
+
+def test_supported_keeps_every_default_buff_on_ee12hp():
+    assert supported(DEFAULT_POOL, EE12HP()) == list(DEFAULT_POOL)
+
+
+def test_explore_ee8n1cjp():
+    rotation = EE8N1CJP()
+    results = explore(25, AtkAtk, PJWS(1, rotation=rotation), rotation, max_size=2)
+    teams = [result[0] for result in results]
+    assert () in teams
+    assert all('FurinaC0' not in team and 'TTDSXianyun' not in team for team in teams)
+    assert all(result[-1] > 0 for result in results)
+    assert [result[-1] for result in results] == sorted((result[-1] for result in results), reverse=True)
@@ -1,19 +1,38 @@
 from rotations import *
 from stats import Stats
 
+import copy
+import furina
+
 class Weapon:
     """
-    Represents a weapon.
+    Represents a weapon. Weapons are declared as data: stats_table and
+    passive_table hold their values, which are resolved for the weapon's
+    refinement once, on construction.
 
     Attributes:
-        refine: Weapon refinement. Must be between [1, 5].
+        refine: Weapon refinement. Must be between [1, 5]. May also be a NumPy
+            array of refinements, e.g. np.arange(1, 6)[:, None], which evaluates
+            all of them at once along the array's axes.
         rotation: Xiao rotation combo. Default: EE12HP
+        stat_dependent: True if dynamic_stats scales off of the current stats.
+        stats_table: Base stats of the weapon. Each value is either a number or an
+            (R1 value, increase per refine) pair.
+        passive_table: Values used by the weapon's passive, each an (R1 value,
+            increase per refine) pair.
+        base_stats: stats_table at this refinement.
+        passive: passive_table at this refinement.
     """
 
+    stat_dependent = False
+    stats_table = {}
+    passive_table = {}
+
     def __init__(self, refine: int = 1, rotation: Rotation = EE12HP()):
-        self.base_stats = Stats()
         self.refine = refine
         self.rotation = rotation
+        self.base_stats = Stats(**{name: self._refined(value) for name, value in self.stats_table.items()})
+        self.passive = {name: self._refined(value) for name, value in self.passive_table.items()}
 
     def __str__(self):
         return self.__class__.__name__
@@ -24,11 +43,27 @@ class Weapon:
         """
         return Stats()
 
+    def refined(self, refine):
+        """
+        Returns a copy of the weapon at another refinement, e.g. one of the
+        refinements of a weapon built with a NumPy array of them.
+        """
+        weapon = copy.copy(self)
+        # Only the tables depend on the refinement, see Weapon.
+        Weapon.__init__(weapon, refine, self.rotation)
+        return weapon
+
     def _stat(self, base, increase):
         """
         Private method. Calculate stats that increase based on weapon refinement.
         """
         return base + increase * (self.refine - 1)
+
+    def _refined(self, value):
+        """
+        Private method. Resolves a stats_table or passive_table value.
+        """
+        return self._stat(*value) if isinstance(value, tuple) else value
     
 
 class PJWS(Weapon):
@@ -39,9 +74,11 @@ class PJWS(Weapon):
         stacked: True if weapon is prestacked.
     """
 
+    stats_table = {'base_atk': 674, 'crate': 0.221}
+    passive_table = {'atk_per_stack': (0.032, 0.007), 'bonus_dmg': (0.12, 0.03)}
+
     def __init__(self, refine: int = 1, rotation: Rotation = EE12HP(), stacked: bool = False):
         super().__init__(refine, rotation)
-        self.base_stats = Stats(base_atk=674, crate=0.221)
         self.stacked = stacked
 
     def __str__(self):
@@ -51,8 +88,8 @@ class PJWS(Weapon):
         return output
 
     def dynamic_stats(self, num_hits, stats: Stats):
-        atk_increase = self._stat(0.032, 0.007)
-        bonus_dmg = self._stat(0.12, 0.03)
+        atk_increase = self.passive['atk_per_stack']
+        bonus_dmg = self.passive['bonus_dmg']
 
         if num_hits < 7 and not self.stacked:
             return Stats(atk=num_hits*atk_increase)
@@ -66,22 +103,32 @@ class Homa(Weapon):
 
     Additional Attributes:
         below50: True if character HP is below 50%.
+        team: Name of a team config in furina.configs(). If given, whether Xiao is
+            below 50% HP is looked up at each hit from its simulation instead.
     """
 
-    def __init__(self, refine: int = 1, rotation: Rotation = EE12HP(), below50: bool = False):
+    stat_dependent = True
+    stats_table = {'base_atk': 608, 'hp': (0.20, 0.05), 'cdmg': 0.662}
+    passive_table = {'atk_per_hp': (0.008, 0.002), 'atk_per_hp_below50': (0.018, 0.004)}
+
+    def __init__(
+        self, refine: int = 1, rotation: Rotation = EE12HP(), below50: bool = False, team: str = None
+    ):
         super().__init__(refine, rotation)
-        hp_increase = self._stat(0.20, 0.05)
-        self.base_stats = Stats(base_atk=608, hp=hp_increase, cdmg=0.662)
         self.below50 = below50
+        self.team = team
 
     def __str__(self):
         output = super().__str__()
-        if self.below50:
+        if self.team is not None:
+            output += " ({})".format(self.team)
+        elif self.below50:
             output += " (50%)"
         return output
 
     def dynamic_stats(self, num_hits, stats: Stats):
-        atk_increase = self._stat(0.018, 0.004) if self.below50 else self._stat(0.008, 0.002)
+        below50 = self.below50 if self.team is None else furina.tables(self.team).xiao_hp[num_hits] < 0.5
+        atk_increase = self.passive['atk_per_hp_below50'] if below50 else self.passive['atk_per_hp']
         return Stats(flat_atk=atk_increase*stats.total_hp())
     
 
@@ -94,9 +141,11 @@ class Vortex(Weapon):
         stacked: True if weapon is prestacked.
     """
 
+    stats_table = {'base_atk': 608, 'atk': 0.496}
+    passive_table = {'atk_per_stack': (0.04, 0.01), 'atk_per_stack_shielded': (0.08, 0.02)}
+
     def __init__(self, refine: int = 1, rotation: Rotation = EE12HP(), shielded: bool = False, stacked: bool = False):
         super().__init__(refine, rotation)
-        self.base_stats = Stats(base_atk=608, atk=0.496)
         self.shielded = shielded
         self.stacked = stacked
     
@@ -107,7 +156,7 @@ class Vortex(Weapon):
 
     def dynamic_stats(self, num_hits, stats: Stats):
         num_hits = 5 if self.stacked else min(num_hits, 5)
-        atk_increase = self._stat(0.08, 0.02) if self.shielded else self._stat(0.04, 0.01)
+        atk_increase = self.passive['atk_per_stack_shielded'] if self.shielded else self.passive['atk_per_stack']
         return Stats(atk=num_hits*atk_increase)
 
 class CalamityQueller(Weapon):
@@ -118,9 +167,11 @@ class CalamityQueller(Weapon):
         stacked: True if weapon is prestacked.
     """
 
+    stats_table = {'base_atk': 741, 'atk': 0.165, 'bonus_dmg': (0.12, 0.03)}
+    passive_table = {'atk_per_stack': (0.032, 0.008)}
+
     def __init__(self, refine: int = 1, rotation: Rotation = EE12HP(), stacked: bool = False):
         super().__init__(refine, rotation)
-        self.base_stats = Stats(base_atk=741, atk=0.165, bonus_dmg=self._stat(0.12, 0.03))
         self.stacked = stacked
     
     def __str__(self):
@@ -128,7 +179,7 @@ class CalamityQueller(Weapon):
         return '{} ({})'.format(super().__str__(), stacked)
 
     def dynamic_stats(self, num_hits, stats: Stats):
-        atk_increase = self._stat(0.032, 0.008) 
+        atk_increase = self.passive['atk_per_stack']
         stacks = 6 if self.stacked else self.rotation.calamity_stacks(num_hits)
         return Stats(atk=stacks*atk_increase)
 
@@ -137,9 +188,7 @@ class SkywardSpine(Weapon):
     Skyward Spine.
     """
 
-    def __init__(self, refine: int = 1, rotation: Rotation = EE12HP()):
-        super().__init__(refine, rotation)
-        self.base_stats = Stats(base_atk=674, crate=self._stat(0.08, 0.02), er=0.368)
+    stats_table = {'base_atk': 674, 'crate': (0.08, 0.02), 'er': 0.368}
 
 
 class EngulfingLightning(Weapon):
@@ -147,15 +196,16 @@ class EngulfingLightning(Weapon):
     Engulfing Lightning.
     """
 
-    def __init__(self, refine: int = 1, rotation: Rotation = EE12HP()):
-        super().__init__(refine, rotation)
-        self.base_stats = Stats(base_atk=608, er=0.551)
-    
+    stat_dependent = True
+    stats_table = {'base_atk': 608, 'er': 0.551}
+    passive_table = {'er': (0.30, 0.05), 'atk_per_er': (0.28, 0.07)}
+
     def dynamic_stats(self, num_hits, stats: Stats):
         active_er = stats.er
         if self.rotation.engulfing_active(num_hits):
-            active_er += self._stat(0.30, 0.05)
-        atk_increase = self._stat(0.28, 0.07) * active_er
+            # Not +=, which would modify stats.er in place when it is an array.
+            active_er = active_er + self.passive['er']
+        atk_increase = self.passive['atk_per_er'] * active_er
         return Stats(atk=atk_increase)
 
 
@@ -164,12 +214,13 @@ class StaffOfTheScarletSands(Weapon):
     Staff of the Scarlet Sands.
     """
 
-    def __init__(self, refine: int = 1, rotation: Rotation = EE12HP()):
-        super().__init__(refine, rotation)
-        self.base_stats = Stats(base_atk=542, crate=0.441)
-    
+    stat_dependent = True
+    stats_table = {'base_atk': 542, 'crate': 0.441}
+    passive_table = {'atk_per_em': (0.52, 0.13), 'atk_per_em_per_stack': (0.28, 0.07)}
+
     def dynamic_stats(self, num_hits, stats: Stats):
-        atk_increase = self._stat(0.52, 0.13) + self._stat(0.28, 0.07) * self.rotation.soss_stacks(num_hits)
+        atk_increase = self.passive['atk_per_em'] + \
+            self.passive['atk_per_em_per_stack'] * self.rotation.soss_stacks(num_hits)
         return Stats(flat_atk=atk_increase * stats.em)
     
 class LumidouceElegy(Weapon):
@@ -177,30 +228,25 @@ class LumidouceElegy(Weapon):
     Lumidouce Elegy.
     """
 
-    def __init__(self, refine: int = 1, rotation: Rotation = EE12HP()):
-        super().__init__(refine, rotation)
-        self.base_stats = Stats(base_atk=608, crate=0.331, atk=self._stat(0.15, 0.04))
+    stats_table = {'base_atk': 608, 'crate': 0.331, 'atk': (0.15, 0.04)}
 
 class FracturedHalo(Weapon):
     """
     Fractured Halo.
     """
 
-    def __init__(self, refine: int = 1, rotation: Rotation = EE12HP()):
-        super().__init__(refine, rotation)
-        self.base_stats = Stats(base_atk=608, cdmg=0.662, atk=self._stat(0.24, 0.06))
+    stats_table = {'base_atk': 608, 'cdmg': 0.662, 'atk': (0.24, 0.06)}
 
 class SacrificersStaff(Weapon):
     """
     Sacrificer's Staff.
     """
 
-    def __init__(self, refine: int = 1, rotation: Rotation = EE12HP()):
-        super().__init__(refine, rotation)
-        self.base_stats = Stats(base_atk=620, crate=0.092)
-    
+    stats_table = {'base_atk': 620, 'crate': 0.092}
+    passive_table = {'atk_per_stack': (0.08, 0.02)}
+
     def dynamic_stats(self, num_hits, stats: Stats):
-        atk_increase = self._stat(0.08, 0.02) * self.rotation.sacstaff_stacks(num_hits)
+        atk_increase = self.passive['atk_per_stack'] * self.rotation.sacstaff_stacks(num_hits)
         return Stats(atk=atk_increase)
 
 
@@ -212,17 +258,19 @@ class Lithic(Weapon):
         stacks: Number of stacks to assume. Must be between [1, 4].
     """
 
+    stats_table = {'base_atk': 565, 'atk': 0.276}
+    passive_table = {'atk_per_stack': (0.07, 0.01), 'crate_per_stack': (0.03, 0.01)}
+
     def __init__(self, refine: int = 1, rotation: Rotation = EE12HP(), stacks: int = 1):
         super().__init__(refine, rotation)
-        self.base_stats = Stats(base_atk=565, atk=0.276)
         self.stacks = stacks
     
     def __str__(self):
         return '{} ({} Stacks)'.format(super().__str__(), self.stacks)
     
     def dynamic_stats(self, num_hits, stats: Stats):
-        atk_increase = self._stat(0.07, 0.01) * self.stacks
-        crate_increase = self._stat(0.03, 0.01) * self.stacks
+        atk_increase = self.passive['atk_per_stack'] * self.stacks
+        crate_increase = self.passive['crate_per_stack'] * self.stacks
         return Stats(atk=atk_increase, crate=crate_increase)
 
 
@@ -234,9 +282,11 @@ class Deathmatch(Weapon):
         num_opponents: Number of opponents near character.
     """
     
+    stats_table = {'base_atk': 454, 'crate': 0.368}
+    passive_table = {'atk_1_opponent': (0.24, 0.06), 'atk_2_opponents': (0.16, 0.04)}
+
     def __init__(self, refine: int = 1, rotation: Rotation = EE12HP(), num_opponents: int = 1):
         super().__init__(refine, rotation)
-        self.base_stats = Stats(base_atk=454, crate=0.368)
         self.num_opponents = num_opponents
     
     def __str__(self):
@@ -244,7 +294,7 @@ class Deathmatch(Weapon):
         return '{} ({})'.format(super().__str__(), num_opponents)
     
     def dynamic_stats(self, num_hits, stats: Stats):
-        atk_increase = self._stat(0.24, 0.06) if self.num_opponents < 2 else self._stat(0.16, 0.04)
+        atk_increase = self.passive['atk_1_opponent'] if self.num_opponents < 2 else self.passive['atk_2_opponents']
         return Stats(atk=atk_increase)
 
 
@@ -256,16 +306,18 @@ class Blackcliff(Weapon):
         stacks: Number of stacks to assume. Must be between [0, 3].
     """
 
+    stats_table = {'base_atk': 510, 'cdmg': 0.551}
+    passive_table = {'atk_per_stack': (0.12, 0.03)}
+
     def __init__(self, refine: int = 1, rotation: Rotation = EE12HP(), stacks: int = 0):
         super().__init__(refine, rotation)
-        self.base_stats = Stats(base_atk=510, cdmg=0.551)
         self.stacks = stacks
     
     def __str__(self):
         return '{} ({} Stacks)'.format(super().__str__(), self.stacks)
     
     def dynamic_stats(self, num_hits, stats: Stats):
-        atk_increase = self._stat(0.12, 0.03) * self.stacks
+        atk_increase = self.passive['atk_per_stack'] * self.stacks
         return Stats(atk=atk_increase)
 
 
@@ -277,9 +329,11 @@ class MissiveWindspear(Weapon):
         passive_active: True if passive is active.
     """
 
+    stats_table = {'base_atk': 510, 'atk': 0.4135}
+    passive_table = {'atk': (0.12, 0.03)}
+
     def __init__(self, refine: int = 1, rotation: Rotation = EE12HP(), passive_active: bool = False):
         super().__init__(refine, rotation)
-        self.base_stats = Stats(base_atk=510, atk=0.4135)
         self.passive_active = passive_active
     
     def __str__(self):
@@ -287,7 +341,7 @@ class MissiveWindspear(Weapon):
     
     def dynamic_stats(self, num_hits, stats: Stats):
         if self.passive_active:
-            return Stats(atk=self._stat(0.12, 0.03))
+            return Stats(atk=self.passive['atk'])
         return Stats()
 
 
@@ -296,9 +350,7 @@ class WavebreakersFin(Weapon):
     Wavebreaker's Fin.
     """
 
-    def __init__(self, refine: int = 1, rotation: Rotation = EE12HP()):
-        super().__init__(refine, rotation)
-        self.base_stats = Stats(base_atk=620, atk=0.138)
+    stats_table = {'base_atk': 620, 'atk': 0.138}
 
 
 class FavoniusLance(Weapon):
@@ -306,9 +358,7 @@ class FavoniusLance(Weapon):
     Favonius Lance.
     """
 
-    def __init__(self, refine: int = 1, rotation: Rotation = EE12HP()):
-        super().__init__(refine, rotation)
-        self.base_stats = Stats(base_atk=565, er=0.306)
+    stats_table = {'base_atk': 565, 'er': 0.306}
 
 
 class PrototypeStarglitter(Weapon):
@@ -316,9 +366,7 @@ class PrototypeStarglitter(Weapon):
     Prototype Starglitter.
     """
 
-    def __init__(self, refine: int = 1, rotation: Rotation = EE12HP()):
-        super().__init__(refine, rotation)
-        self.base_stats = Stats(base_atk=510, er=0.459)
+    stats_table = {'base_atk': 510, 'er': 0.459}
 
 
 class WhiteTassel(Weapon):
@@ -326,6 +374,4 @@ class WhiteTassel(Weapon):
     White Tassel.
     """
 
-    def __init__(self, refine: int = 1, rotation: Rotation = EE12HP()):
-        super().__init__(refine, rotation)
-        self.base_stats = Stats(base_atk=401, crate=0.234)
+    stats_table = {'base_atk': 401, 'crate': 0.234}
@@ -4,8 +4,104 @@ from stats import Stats
 from rotations import *
 from weapons import *
 
+import numpy as np
+from functools import lru_cache
 from typing import List
 
+# Xiao's attacks: action -> (talent modifier, in Burst, number of hits). Hits of one
+# attack share dynamic stats, e.g. Xiao's N1 hits twice.
+ATTACKS = {
+    'skill': (4.5504, False, 1),
+    'n1': (0.4914, True, 2),
+    'ca': (2.1603, True, 1),
+    'high_plunge': (4.0402, True, 1),
+}
+
+@lru_cache(maxsize=None)
+def compile_actions(actions):
+    """
+    Flattens a rotation's action sequence (see Rotation.actions) into a tuple of
+    (action, modifier, burst, hits) descriptors, one per action performed. Casting
+    Burst has no modifier.
+    """
+    descriptors = []
+    for action, repeat in actions:
+        if isinstance(action, tuple):
+            # Nested sequence, repeated as a group.
+            descriptors.extend(compile_actions(action) * repeat)
+        elif action == 'burst':
+            descriptors.extend([(action, None, True, 0)] * repeat)
+        elif action in ATTACKS:
+            descriptors.extend([(action,) + ATTACKS[action]] * repeat)
+        else:
+            raise ValueError('Unknown action: {}'.format(action))
+    return tuple(descriptors)
+
+class HitPlan:
+    """
+    Precompiled dynamic stats for each hit of a rotation.
+
+    For a fixed weapon, artifact set, buffs and rotation, the dynamic stats of a hit
+    only depend on the hit count, except for weapon passives that scale off of
+    current stats (see Weapon.stat_dependent). A plan is filled in by the first Xiao
+    that uses it and then shared by every substat split of the same chart cell.
+
+    Attributes:
+        hits: Maps (num_hits, burst) to a (head, tail) pair. For stat dependent
+            weapons, the weapon's dynamic stats go between head and each Stats in
+            tail. Otherwise head already includes everything and tail is empty.
+    """
+
+    def __init__(self):
+        self.hits = {}
+
+
+class HitTrace:
+    """
+    Column-wise record of every hit of a traced Xiao, for breaking down where its
+    damage comes from. Columns are:
+
+        hit, action, modifier: Hit count, attack and talent modifier of the hit.
+        <stat>: Each of the hit's effective stats, see Stats.
+        total_atk, crit_mult, dmg_bonus_mult, res_mult, def_mult: Total ATK and
+            the multipliers of the DMG formula.
+        dmg: Damage of the hit.
+        <source>.<stat>: Dynamic stats each source gave the hit, for sources a4,
+            artifact, a1, weapon and each buff by name. Only stats a source ever
+            gives get a column, which is 0 at hits it gives nothing.
+
+    Attributes:
+        columns: Maps each column name to a list of its value at every hit.
+        num_hits: Number of hits recorded.
+    """
+
+    def __init__(self):
+        self.columns = {}
+        self.num_hits = 0
+
+    def __len__(self):
+        return self.num_hits
+
+    def append(self, values: dict):
+        """
+        Records a hit. Columns without a value get 0 for it.
+        """
+        for name, value in values.items():
+            if name not in self.columns:
+                self.columns[name] = [0.0] * self.num_hits
+            self.columns[name].append(value)
+        self.num_hits += 1
+        for column in self.columns.values():
+            if len(column) < self.num_hits:
+                column.append(0.0)
+
+    def table(self):
+        """
+        Returns the trace as a header row followed by one row per hit.
+        """
+        return [list(self.columns)] + [list(row) for row in zip(*self.columns.values())]
+
+
 class Xiao:
     """
     Xiao.
@@ -14,36 +110,96 @@ class Xiao:
         weapon: Xiao's weapon.
         artifacts: Xiao's artifact set.
         buffs: Xiao's team buffs.
+        plan: HitPlan to share with other Xiaos with the same weapon, artifact set,
+            buffs, and rotation. Each Xiao gets its own plan by default.
+        trace: HitTrace of every hit if tracing, else None. Tracing is off by
+            default, so hits are not recorded at all.
+
+    A Xiao can run its rotation again after reset, e.g. with another substat split,
+    without recomputing its base stats or reallocating anything.
     """
 
-    def __init__(self, weapon: Weapon, artifact: Artifact, buffs: List[Buff], rotation: Rotation):
+    def __init__(
+        self, weapon: Weapon, artifact: Artifact, buffs: List[Buff], rotation: Rotation,
+        plan: HitPlan = None, trace: bool = False
+    ):
         self.weapon = weapon
         self.artifact = artifact
         self.buffs = buffs
         self.rotation = rotation
+        self.plan = plan if plan is not None else HitPlan()
+        self.trace = HitTrace() if trace else None
 
-        # add static base stats
-        self.stats = Stats(base_hp=12736, base_atk=349.2, crate=0.242, cdmg=0.5)
-        self.stats += weapon.base_stats
+        # add static base stats, keeping character and weapon stats for reset
+        self._base_stats = Stats(base_hp=12736, base_atk=349.2, crate=0.242, cdmg=0.5)
+        self._base_stats += weapon.base_stats
+        self.stats = self._base_stats.copy()
         self.stats += artifact.base_stats
 
         # keep track of damage
-        self.damage_history = []
         self.total_damage = 0.0
         self.num_hits = 0
 
+        # Scratch buffers reused by every hit instead of allocating new Stats.
+        self._dynamic_stats = Stats()
+        self._effective_stats = Stats()
+        self._artifact_stats = Stats()
+
+        # Action and dynamic stats by source of the current attack, when tracing.
+        self._action = None
+        self._sources = None
+
+    @property
+    def damage_history(self):
+        """
+        Damage of each hit so far. Empty unless tracing, see HitTrace.
+        """
+        return self.trace.columns.get('dmg', []) if self.trace is not None else []
+
     ##################
     # Public Methods #
     ##################
 
+    def reset(self, subs: Stats = None):
+        """
+        Undoes any run, so the rotation can be run again: stats go back to those
+        from construction and damage back to 0. If given, subs are added to the
+        artifact set's base stats, the same as constructing Xiao with an artifact
+        set holding them, e.g. a Stats filled in with add_artifact_subs.
+        """
+        artifact_stats = self._artifact_stats.assign(self.artifact.base_stats)
+        if subs is not None:
+            artifact_stats += subs
+        self.stats.assign(self._base_stats)
+        self.stats += artifact_stats
+
+        self.total_damage = 0.0
+        self.num_hits = 0
+        if self.trace is not None:
+            self.trace = HitTrace()
+        return self
+
+    def run(self):
+        """
+        Performs the rotation's action sequence and returns the total damage.
+        """
+        for action, modifier, burst, hits in compile_actions(self.rotation.actions):
+            if modifier is None:
+                self.burst()
+                continue
+            dynamic_stats = self._get_dynamic_stats(burst)
+            if self.trace is not None:
+                self._trace_attack(action, burst)
+            for _ in range(hits):
+                self._dmgcalc(modifier, dynamic_stats)
+        return self.total_damage
+
     def skill(self):
         """
         Xiao's Elemental Skill: Lemniscatic Wind Cycling
         """
         # Add dynamic buffs from A4, weapon, and buffs.
-        modifier = 4.5504
-        dynamic_stats = self._get_dynamic_stats(burst=False)
-        self._dmgcalc(modifier, dynamic_stats)
+        self._attack('skill')
 
     def burst(self):
         """
@@ -55,32 +211,35 @@ class Xiao:
         """
         Xiao's N1
         """
-        modifier = 0.4914
-        dynamic_stats = self._get_dynamic_stats(burst=True)
-        # Xiao's N1 hits twice.
-        self._dmgcalc(modifier, dynamic_stats)
-        self._dmgcalc(modifier, dynamic_stats)
+        self._attack('n1')
     
     def ca(self):
         """
         Xiao's Charged Attack.
         """
-        modifier = 2.1603
-        dynamic_stats = self._get_dynamic_stats(burst=True)
-        self._dmgcalc(modifier, dynamic_stats)
+        self._attack('ca')
 
     def high_plunge(self):
         """
         Xiao's High Plunge
         """
-        modifier = 4.0402
-        dynamic_stats = self._get_dynamic_stats(burst=True)
-        self._dmgcalc(modifier, dynamic_stats)
+        self._attack('high_plunge')
     
     ###################
     # Private Methods #
     ###################
 
+    def _attack(self, action: str):
+        """
+        Performs one of Xiao's attacks. All of its hits share one snapshot of dynamic stats.
+        """
+        modifier, burst, hits = ATTACKS[action]
+        dynamic_stats = self._get_dynamic_stats(burst)
+        if self.trace is not None:
+            self._trace_attack(action, burst)
+        for _ in range(hits):
+            self._dmgcalc(modifier, dynamic_stats)
+
     def _a1(self):
         """
         Xiao's Ascension 1 Talent
@@ -91,39 +250,102 @@ class Xiao:
         """"
         Get dynamic buffs from artifacts, weapon, passives, and buffs.
         """
+        key = (self.num_hits, burst)
+        if key not in self.plan.hits:
+            self.plan.hits[key] = self._compile_hit(burst)
+        head, tail = self.plan.hits[key]
+
+        if not self.weapon.stat_dependent:
+            return head
+
+        # Only stat dependent weapon passives are evaluated per hit.
+        dynamic_stats = self._dynamic_stats.assign(head)
+        dynamic_stats += self.weapon.dynamic_stats(num_hits=self.num_hits, stats=self.stats)
+        for stats in tail:
+            dynamic_stats += stats
+        return dynamic_stats
+
+    def _compile_hit(self, burst: bool):
+        """
+        Get the dynamic buffs of the current hit that do not depend on current stats.
+        Returns a (head, tail) pair, see HitPlan.
+        """
         if burst:
             # Artifact and A1 buffs only apply in Burst.
-            dynamic_stats = self.artifact.dynamic_stats(num_hits=self.num_hits)
-            dynamic_stats += self._a1()
+            head = self.artifact.dynamic_stats(num_hits=self.num_hits)
+            head += self._a1()
         else:
             # A4 buff only applies to Skills.
-            dynamic_stats = Stats(bonus_dmg=self.num_hits * 0.15)
+            head = Stats(bonus_dmg=self.num_hits * 0.15)
 
         # Weapon and support buffs apply to both skill and burst.
-        dynamic_stats += self.weapon.dynamic_stats(num_hits=self.num_hits, stats=self.stats)        
-        for buff in self.buffs:
-            dynamic_stats += buff.buff(num_hits=self.num_hits)
-        
-        return dynamic_stats
+        tail = [buff.buff(num_hits=self.num_hits) for buff in self.buffs]
+        if self.weapon.stat_dependent:
+            return head, tail
+
+        head += self.weapon.dynamic_stats(num_hits=self.num_hits, stats=self.stats)
+        for stats in tail:
+            head += stats
+        return head, []
 
     def _dmgcalc(self, modifier, dynamic_stats: Stats):
         """
         Calculates damage using current effective stats.
         """
-        effective_stats = self.stats + dynamic_stats
+        effective_stats = self._effective_stats.assign(self.stats)
+        effective_stats += dynamic_stats
+
+        # Stats may hold arrays when evaluating many substat splits at once.
+        crate = effective_stats.crate
+        crate = np.minimum(1.0, crate) if isinstance(crate, np.ndarray) else min(1.0, crate)
 
         # DMG formula.
+        total_atk = effective_stats.total_atk()
+        crit_mult = 1 + crate * effective_stats.cdmg
+        dmg_bonus_mult = 1 + effective_stats.anemo_dmg + effective_stats.bonus_dmg
         enemy_res_mult = self._get_enemy_res_mult(effective_stats.res_shred)
         enemy_def_mult = (190 / (190 + 200))
-        dmg = (effective_stats.total_atk() * modifier + effective_stats.flat_dmg) * \
-            (1 + min(1.0, effective_stats.crate) * effective_stats.cdmg) * \
-            (1 + effective_stats.anemo_dmg + effective_stats.bonus_dmg) * \
+        dmg = (total_atk * modifier + effective_stats.flat_dmg) * crit_mult * dmg_bonus_mult * \
             enemy_res_mult * enemy_def_mult
         
         # Track damage instance.
-        self.damage_history.append(dmg)
+        if self.trace is not None:
+            self._trace_hit(modifier, total_atk, crit_mult, dmg_bonus_mult, enemy_res_mult, enemy_def_mult, dmg)
         self.total_damage += dmg
         self.num_hits += 1
+
+    def _trace_attack(self, action: str, burst: bool):
+        """
+        Records the current attack's action and its dynamic stats by source, as
+        _get_dynamic_stats snapshots them, for _trace_hit.
+        """
+        if burst:
+            sources = [('artifact', self.artifact.dynamic_stats(num_hits=self.num_hits)), ('a1', self._a1())]
+        else:
+            sources = [('a4', Stats(bonus_dmg=self.num_hits * 0.15))]
+        sources.append(('weapon', self.weapon.dynamic_stats(num_hits=self.num_hits, stats=self.stats)))
+        sources.extend((str(buff), buff.buff(num_hits=self.num_hits)) for buff in self.buffs)
+        self._action = action
+        self._sources = sources
+
+    def _trace_hit(self, modifier, total_atk, crit_mult, dmg_bonus_mult, res_mult, def_mult, dmg):
+        """
+        Records the current hit, see HitTrace. _dmgcalc leaves its effective stats
+        in their scratch buffer.
+        """
+        values = {'hit': self.num_hits, 'action': self._action, 'modifier': modifier}
+        for name in Stats.__slots__:
+            values[name] = getattr(self._effective_stats, name)
+        values.update(
+            total_atk=total_atk, crit_mult=crit_mult, dmg_bonus_mult=dmg_bonus_mult, res_mult=res_mult,
+            def_mult=def_mult, dmg=dmg
+        )
+        for source, stats in self._sources:
+            for name in Stats.__slots__:
+                value = getattr(stats, name)
+                if np.any(value != 0):
+                    values['{}.{}'.format(source, name)] = value
+        self.trace.append(values)
     
     def _get_enemy_res_mult(self, res_shred):
         """
@@ -136,3 +358,113 @@ class Xiao:
             return 1.0 - resistance
         else:
             return 1.0/(4.0*resistance + 1.0)
+
+
+class GradientXiao(Xiao):
+    """
+    Xiao that also accumulates the analytic gradient of its total damage with
+    respect to its ATK%, crit rate and crit DMG, differentiating the DMG formula
+    of Xiao._dmgcalc hit by hit. Weapon passives and buffs must not scale off of
+    these three stats, which holds for every current one.
+
+    Attributes:
+        gradient: Stats holding the partial derivative of total damage with
+            respect to atk, crate and cdmg. Every other stat is left at 0.
+    """
+
+    def __init__(
+        self, weapon: Weapon, artifact: Artifact, buffs: List[Buff], rotation: Rotation,
+        plan: HitPlan = None
+    ):
+        super().__init__(weapon, artifact, buffs, rotation, plan)
+        self.gradient = Stats()
+
+    ##################
+    # Public Methods #
+    ##################
+
+    def reset(self, subs: Stats = None):
+        super().reset(subs)
+        self.gradient.reset()
+        return self
+
+    ###################
+    # Private Methods #
+    ###################
+
+    def _dmgcalc(self, modifier, dynamic_stats: Stats):
+        """
+        Calculates damage, then adds the hit's partial derivatives to gradient.
+        """
+        super()._dmgcalc(modifier, dynamic_stats)
+
+        # _dmgcalc leaves the hit's effective stats in its scratch buffer.
+        effective_stats = self._effective_stats
+        capped = effective_stats.crate >= 1.0
+        crate = np.minimum(1.0, effective_stats.crate)
+
+        atk_term = effective_stats.total_atk() * modifier + effective_stats.flat_dmg
+        crit_mult = 1 + crate * effective_stats.cdmg
+        other_mult = (1 + effective_stats.anemo_dmg + effective_stats.bonus_dmg) * \
+            self._get_enemy_res_mult(effective_stats.res_shred) * (190 / (190 + 200))
+
+        self.gradient.atk += effective_stats.base_atk * modifier * crit_mult * other_mult
+        self.gradient.crate += np.where(capped, 0.0, atk_term * effective_stats.cdmg * other_mult)
+        self.gradient.cdmg += atk_term * crate * other_mult
+
+
+class PeakXiao(Xiao):
+    """
+    Xiao that, instead of dealing damage, records the elementwise maximum of its
+    effective stats over every hit of the rotation. Damage increases with every
+    stat, so damage from these peak stats bounds the damage of every hit from
+    above. Weapon passives must not scale off of ATK%, crit rate or crit DMG,
+    which holds for every current one.
+
+    Attributes:
+        peak: Elementwise maximum of the effective stats of every hit so far.
+        modifier: Sum of the talent modifiers of every hit so far.
+    """
+
+    def __init__(
+        self, weapon: Weapon, artifact: Artifact, buffs: List[Buff], rotation: Rotation,
+        plan: HitPlan = None
+    ):
+        super().__init__(weapon, artifact, buffs, rotation, plan)
+        self.peak = None
+        self.modifier = 0.0
+
+    ##################
+    # Public Methods #
+    ##################
+
+    def reset(self, subs: Stats = None):
+        super().reset(subs)
+        self.peak = None
+        self.modifier = 0.0
+        return self
+
+    def bound(self, stats: Stats):
+        """
+        Returns an upper bound of the damage of a rotation like the one run, for a
+        Xiao whose effective stats never exceed stats at any hit. The DMG formula
+        of Xiao._dmgcalc, applied to all hits at once.
+        """
+        crate = np.minimum(1.0, stats.crate)
+        return (stats.total_atk() * self.modifier + stats.flat_dmg * self.num_hits) * \
+            (1 + crate * stats.cdmg) * \
+            (1 + stats.anemo_dmg + stats.bonus_dmg) * \
+            self._get_enemy_res_mult(stats.res_shred) * (190 / (190 + 200))
+
+    ###################
+    # Private Methods #
+    ###################
+
+    def _dmgcalc(self, modifier, dynamic_stats: Stats):
+        """
+        Records the hit's effective stats and modifier.
+        """
+        effective_stats = self.stats + dynamic_stats
+        self.peak = effective_stats if self.peak is None else self.peak.maximum(effective_stats)
+        self.modifier += modifier
+        self.num_hits += 1